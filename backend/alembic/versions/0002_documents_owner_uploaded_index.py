@@ -0,0 +1,27 @@
+"""add (owner_id, upload_timestamp DESC) index on documents
+
+Revision ID: 0002_documents_owner_uploaded_index
+Revises: 0001_initial_schema
+Create Date: 2026-10-15
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0002_documents_owner_uploaded_index"
+down_revision = "0001_initial_schema"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index(
+        "ix_documents_owner_uploaded",
+        "documents",
+        ["owner_id", sa.text("upload_timestamp DESC")],
+        if_not_exists=True,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_documents_owner_uploaded", table_name="documents")
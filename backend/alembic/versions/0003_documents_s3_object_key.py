@@ -0,0 +1,28 @@
+"""store the S3 object key instead of the full URL on documents
+
+Revision ID: 0003_documents_s3_object_key
+Revises: 0002_documents_owner_uploaded_index
+Create Date: 2026-10-15
+"""
+from alembic import op
+
+
+revision = "0003_documents_s3_object_key"
+down_revision = "0002_documents_owner_uploaded_index"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.alter_column("documents", "file_path", new_column_name="s3_object_key")
+    # Existing rows hold https://<bucket>.s3.<region>.amazonaws.com/<key>; keep only <key>.
+    op.execute(
+        "UPDATE documents "
+        "SET s3_object_key = regexp_replace(s3_object_key, '^https?://[^/]+/', '') "
+        "WHERE s3_object_key ~ '^https?://'"
+    )
+
+
+def downgrade() -> None:
+    # The bucket/region part of the old URLs is not restored.
+    op.alter_column("documents", "s3_object_key", new_column_name="file_path")
@@ -1,47 +1,117 @@
 # fullstack_rag/backend/app/api/v1/endpoints/documents.py
+import asyncio
+import logging
 import os
-from datetime import datetime
+from datetime import datetime, timezone
 from typing import Dict, Any, List, Optional
 
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, status
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Query, status
 from sqlalchemy.orm import Session, selectinload 
 from sqlalchemy.ext.asyncio import AsyncSession 
 from sqlalchemy import select
 from celery.result import AsyncResult
+from celery.utils import uuid
 
 from app.db.session import get_db
 from app.db.models import Document, DocumentStatus, User
-from app.crud.document import create_document, delete_document as crud_delete_document
+from app.crud.document import create_document, create_documents, delete_document as crud_delete_document
 from app.crud import document as crud_document
 from app.services.s3_service import s3_service
 from app.tasks.pdf_processing_tasks import process_pdf_task
 from app.core.security import get_current_user 
+from app.core.cache import TTLCache
+from app.core.config import settings
 
 from app.services.embedding_service import embedding_service
 from app.services.vector_db_service import vector_db_service
 from app.services.llm_service import llm_service
 from app.services.reranker_service import reranker_service
-from app.schemas.document import DocumentResponse, DocumentCreate
+from app.services.query_cache_service import query_cache_service
+from app.schemas.document import DocumentResponse, DocumentUploadResponse, DocumentCreate
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
-@router.post("/upload", response_model=DocumentResponse, status_code=status.HTTP_201_CREATED)
+# task_id -> (state, info); absorbs bursts of status polls for the same task.
+_task_status_cache = TTLCache(maxsize=4096, ttl=settings.TASK_STATUS_CACHE_TTL_SECONDS)
+
+
+def _get_task_status(task_id: str):
+    cached = _task_status_cache.get(task_id)
+    if cached is not None:
+        return cached
+    task_result = AsyncResult(task_id)
+    # .state and .info share one backend lookup; .info alone triggers it.
+    info = task_result.info
+    task_status = (task_result.state, info if isinstance(info, dict) else {})
+    _task_status_cache.set(task_id, task_status)
+    return task_status
+
+
+def _select_context_chunks(reranked_chunks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Drop low-scoring chunks and cap the context at RAG_MAX_CONTEXT_TOKENS. The top chunk is always kept."""
+    top_score = reranked_chunks[0].get('relevance_score')
+    if top_score is not None:
+        if top_score > settings.RAG_LOCALIZED_SCORE:
+            return reranked_chunks[:1]
+        reranked_chunks = reranked_chunks[:1] + [
+            chunk for chunk in reranked_chunks[1:]
+            if chunk.get('relevance_score', 0.0) >= settings.RAG_SCORE_FLOOR
+        ]
+
+    selected_chunks = []
+    context_tokens = 0
+    for chunk in reranked_chunks:
+        chunk_tokens = llm_service.count_tokens(chunk['document'])
+        if selected_chunks and context_tokens + chunk_tokens > settings.RAG_MAX_CONTEXT_TOKENS:
+            break
+        selected_chunks.append(chunk)
+        context_tokens += chunk_tokens
+    return selected_chunks
+
+def _build_object_name(title: str, filename: str) -> str:
+    timestamp_str = datetime.now().strftime("%Y%m%d%H%M%S%f")
+    file_extension = os.path.splitext(filename)[1] if '.' in filename else ''
+    return f"raw_pdfs/{timestamp_str}_{title.replace(' ', '_')}{file_extension}"
+
+async def _mark_documents_failed(db: AsyncSession, documents: List[Document]) -> None:
+    """Mark committed documents whose processing task could not be published as FAILED."""
+    for document in documents:
+        document.processing_status = DocumentStatus.FAILED
+    try:
+        await db.commit()
+    except Exception as e:
+        logger.error(f"Failed to mark documents {[document.id for document in documents]} as FAILED: {e}")
+
+async def _wait_for_task_start(task_id: str) -> Optional[str]:
+    """Poll the result backend briefly until the task leaves PENDING. Returns the new state, or None on timeout."""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + settings.UPLOAD_WAIT_INITIAL_SECONDS
+    while True:
+        state = await asyncio.to_thread(lambda: AsyncResult(task_id).state)
+        if state != "PENDING":
+            return state
+        if loop.time() >= deadline:
+            return None
+        await asyncio.sleep(settings.UPLOAD_WAIT_INITIAL_INTERVAL_SECONDS)
+
+@router.post("/upload", response_model=DocumentUploadResponse, status_code=status.HTTP_201_CREATED)
 async def upload_document(
     title: str = Form(...),
     file: UploadFile = File(...),
+    wait_initial: bool = Query(False),
     db: AsyncSession = Depends(get_db), 
     current_user: User = Depends(get_current_user)
 ):
-    print(f"User {current_user.email} (ID: {current_user.id}) is uploading document: {title}")
+    logger.debug(f"User {current_user.email} (ID: {current_user.id}) is uploading document: {title}")
     if not file.filename.lower().endswith(".pdf"):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Please upload a pdf."
         )
 
-    timestamp_str = datetime.now().strftime("%Y%m%d%H%M%S%f")
-    file_extension = os.path.splitext(file.filename)[1] if '.' in file.filename else ''
-    object_name = f"raw_pdfs/{timestamp_str}_{title.replace(' ', '_')}{file_extension}"
+    object_name = _build_object_name(title, file.filename)
     file_size_bytes = file.size
 
     s3_url = await s3_service.upload_file(file, object_name)
@@ -53,29 +123,119 @@ async def upload_document(
         )
 
     try:
+        # Generate the task id up front so the row is written once, and commit
+        # before publishing so the worker always finds the row.
+        celery_task_id = uuid()
         new_document = await create_document(
             db=db,
             document_in=DocumentCreate(title=title),
-            file_path=s3_url,
+            s3_object_key=object_name,
             file_size_bytes=file_size_bytes,
-            owner_id=current_user.id
+            owner_id=current_user.id,
+            celery_task_id=celery_task_id
+        )
+    except Exception as e:
+        await s3_service.delete_file(object_name)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to save document metadata to database: {e}"
         )
-        task = process_pdf_task.delay(new_document.id)
-        new_document.celery_task_id = task.id 
-        db.add(new_document) 
-        await db.commit()
-        await db.refresh(new_document)
-        print(f"Dispatched process_pdf_task for document ID: {new_document.id}")
 
-        return new_document
+    try:
+        await asyncio.to_thread(process_pdf_task.apply_async, args=[new_document.id], task_id=celery_task_id)
+        logger.debug(f"Dispatched process_pdf_task for document ID: {new_document.id}")
+    except Exception as e:
+        await _mark_documents_failed(db, [new_document])
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to dispatch document processing: {e}"
+        )
 
+    upload_response = DocumentUploadResponse.model_validate(new_document)
+    if wait_initial:
+        # Saves clients the first status round trip when the worker is quick to pick the task up.
+        celery_state = await _wait_for_task_start(celery_task_id)
+        if celery_state:
+            upload_response.celery_state = celery_state
+            upload_response.processing_started_at = datetime.now(timezone.utc)
+    return upload_response
+
+@router.post("/upload_batch", response_model=List[DocumentResponse], status_code=status.HTTP_201_CREATED)
+async def upload_documents_batch(
+    titles: List[str] = Form(...),
+    files: List[UploadFile] = File(...),
+    db: AsyncSession = Depends(get_db), 
+    current_user: User = Depends(get_current_user)
+):
+    """Upload several PDFs in one request; titles[i] names files[i]. All rows are committed together."""
+    if len(titles) != len(files):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Each uploaded file needs exactly one title."
+        )
+    if len(files) > settings.MAX_UPLOAD_BATCH_SIZE:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {settings.MAX_UPLOAD_BATCH_SIZE} files can be uploaded per request."
+        )
+    if not all(file.filename.lower().endswith(".pdf") for file in files):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Please upload only pdf files."
+        )
+    logger.debug(f"User {current_user.email} (ID: {current_user.id}) is uploading {len(files)} documents")
+
+    object_names = [_build_object_name(title, file.filename) for title, file in zip(titles, files)]
+    s3_urls = await asyncio.gather(*(
+        s3_service.upload_file(file, object_name) for file, object_name in zip(files, object_names)
+    ))
+    if not all(s3_urls):
+        await asyncio.gather(*(
+            s3_service.delete_file(object_name) for object_name, s3_url in zip(object_names, s3_urls) if s3_url
+        ))
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to upload files to S3."
+        )
+
+    try:
+        celery_task_ids = [uuid() for _ in files]
+        new_documents = await create_documents(
+            db=db,
+            documents_in=[DocumentCreate(title=title) for title in titles],
+            s3_object_keys=object_names,
+            file_sizes_bytes=[file.size for file in files],
+            owner_id=current_user.id,
+            celery_task_ids=celery_task_ids
+        )
+        await db.commit()
     except Exception as e:
-        await s3_service.delete_file(object_name)
+        await asyncio.gather(*(s3_service.delete_file(object_name) for object_name in object_names))
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to save document metadata to database: {e}"
         )
 
+    # Publish only after the commit; a document whose publish fails is marked FAILED.
+    publish_results = await asyncio.gather(
+        *(
+            asyncio.to_thread(process_pdf_task.apply_async, args=[document.id], task_id=celery_task_id)
+            for document, celery_task_id in zip(new_documents, celery_task_ids)
+        ),
+        return_exceptions=True
+    )
+    undispatched = [
+        document for document, result in zip(new_documents, publish_results) if isinstance(result, Exception)
+    ]
+    if undispatched:
+        await _mark_documents_failed(db, undispatched)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to dispatch processing for {len(undispatched)} of {len(new_documents)} documents."
+        )
+    logger.debug(f"Dispatched process_pdf_task for document IDs: {[document.id for document in new_documents]}")
+    return new_documents
+
 @router.get("/{document_id}/query/", response_model=Dict[str, Any]) 
 async def query_document(
     document_id: int,
@@ -84,9 +244,9 @@ async def query_document(
     current_user: User = Depends(get_current_user)
 ):
     # 1. Verify document existence and ownership
-    document = await db.get(Document, document_id)
+    document = await crud_document.get_owned_document(db, document_id, current_user.id)
 
-    if not document or document.owner_id != current_user.id:
+    if not document:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Document not found or you don't have access to it."
@@ -108,27 +268,23 @@ async def query_document(
         )
     
     # 3. Generate embedding for the query
-    query_embeddings_raw = embedding_service.get_embeddings([query_text])
-    if not query_embeddings_raw:
+    query_embedding = await embedding_service.embed(query_text)
+    if query_embedding is None:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Failed to generate embedding for the query."
         )
 
-    query_embeddings_for_chroma = []
-    for emb in query_embeddings_raw:
-        if hasattr(emb, 'tolist'):
-            query_embeddings_for_chroma.append(emb.tolist())
-        else:
-            query_embeddings_for_chroma.append(emb)
+    # Serve near-identical recent queries without retrieval, rerank or LLM calls
+    cached_response = query_cache_service.lookup(document.id, query_embedding, version=document.celery_task_id)
+    if cached_response is not None:
+        return cached_response
 
     # 4. Query ChromaDB for relevant chunks
-    INITIAL_CHROMA_RESULTS = 10
-    TOP_N_RERANKED_RESULTS = 5
     retrieved_chunks_for_reranking = vector_db_service.query_collection(
         collection=collection,
-        query_embeddings=query_embeddings_for_chroma,
-        n_results=INITIAL_CHROMA_RESULTS, 
+        query_embeddings=query_embedding.reshape(1, -1),
+        n_results=settings.RAG_INITIAL_RESULTS,
     )
 
     if not retrieved_chunks_for_reranking:
@@ -141,7 +297,7 @@ async def query_document(
     reranked_chunks_info = await reranker_service.rerank(
     query=query_text,
     documents=retrieved_chunks_for_reranking,
-    top_n=TOP_N_RERANKED_RESULTS
+    top_n=settings.RAG_TOP_N
     )
     if not reranked_chunks_info:
         raise HTTPException(
@@ -149,8 +305,9 @@ async def query_document(
             detail="No relevant chunks found after re-ranking."
         )
     
-    # 6. Construct RAG prompt with TOP N re-ranked chunks
-    context_chunks = [chunk['document'] for chunk in reranked_chunks_info] 
+    # 6. Construct RAG prompt with the re-ranked chunks that clear the score floor
+    reranked_chunks_info = _select_context_chunks(reranked_chunks_info)
+    context_chunks = [chunk['document'] for chunk in reranked_chunks_info]
     context_text = "\n\n".join(context_chunks)
 
     # 7. Construct the RAG prompt
@@ -163,7 +320,8 @@ async def query_document(
 
     Answer: [/INST]"""
 
-    print(f"Sending prompt to LLM (first 500 chars):\n{rag_prompt[:500]}...") # Log first 500 chars of prompt
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"Sending prompt to LLM (first 500 chars):\n{rag_prompt[:500]}...")
 
     # 8. Call the LLMService to generate a response
     llm_response = await llm_service.generate_text(rag_prompt)
@@ -175,10 +333,12 @@ async def query_document(
         )
 
     # 9. Return the LLM's response and optionally include retrieved chunks
-    return {
+    response = {
         "llm_answer": llm_response,
         "retrieved_chunks": reranked_chunks_info 
     }
+    query_cache_service.store(document.id, query_embedding, response, version=document.celery_task_id)
+    return response
 
 @router.get("", response_model=List[DocumentResponse]) 
 async def list_documents(
@@ -200,56 +360,45 @@ async def delete_document(
     current_user: User = Depends(get_current_user)
 ):
     # 1. Verify document existence and ownership
-    document = await db.get(Document, document_id)
+    document = await crud_document.get_owned_document(db, document_id, current_user.id)
 
-    if not document or document.owner_id != current_user.id:
+    if not document:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Document not found or you don't have access to it."
         )
 
-
-    s3_object_name = document.file_path.split('.com/')[-1] 
+    s3_object_name = document.s3_object_key
 
     try:
         # 2. Delete from S3
         s3_deleted = await s3_service.delete_file(s3_object_name)
         if not s3_deleted:
-            print(f"Warning: S3 file {s3_object_name} for document {document_id} might not have been deleted.")
+            logger.warning(f"S3 file {s3_object_name} for document {document_id} might not have been deleted.")
 
         # 3. Delete from ChromaDB
         chroma_collection_name = f"doc_{document.id}"
         vector_db_service.delete_collection(chroma_collection_name)
-        print(f"ChromaDB collection {chroma_collection_name} deleted (if it existed).")
+        query_cache_service.invalidate(document.id)
+        logger.debug(f"ChromaDB collection {chroma_collection_name} deleted (if it existed).")
 
         # 4. Delete from PostgreSQL
         await crud_delete_document(db, document_id)
-        print(f"Document {document_id} deleted from PostgreSQL.")
+        logger.debug(f"Document {document_id} deleted from PostgreSQL.")
 
         return 
     except Exception as e:
-        print(f"Error during document deletion for {document_id}: {e}")
+        logger.error(f"Error during document deletion for {document_id}: {e}")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to delete document and its associated data: {e}"
         )
 
-@router.get("/{document_id}/processing_status/", response_model=Dict[str, Any])
-async def get_document_processing_status(
-    document_id: int, 
-    db: AsyncSession = Depends(get_db),
-    current_user: User = Depends(get_current_user)
-):
-    document = await crud_document.get_document_by_id(db, document_id)
-    if not document or document.owner_id != current_user.id:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Document not found")
-
+def _processing_status_response(document: Document) -> Dict[str, Any]:
     if document.processing_status == DocumentStatus.PROCESSING:
         celery_task_id = document.celery_task_id 
         if celery_task_id:
-            task_result = AsyncResult(celery_task_id)
-            state = task_result.state
-            progress_meta = task_result.info if isinstance(task_result.info, dict) else {}
+            state, progress_meta = _get_task_status(celery_task_id)
 
             return {
                 "document_id": document.id,
@@ -273,4 +422,32 @@ async def get_document_processing_status(
             "celery_state": document.processing_status, 
             "processing_stage": document.processing_status.value,
             "current_progress": 100 if document.processing_status == DocumentStatus.COMPLETED else 0
-        }
\ No newline at end of file
+        }
+
+@router.get("/{document_id}/processing_status/", response_model=Dict[str, Any])
+async def get_document_processing_status(
+    document_id: int, 
+    wait: float = Query(0, ge=0, le=settings.STATUS_LONG_POLL_MAX_SECONDS),
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Returns the processing status. With ``wait`` > 0 the request is held (long-poll)
+    until the document is completed or failed, or ``wait`` seconds have passed.
+    """
+    deadline = asyncio.get_running_loop().time() + wait
+    while True:
+        document = await crud_document.get_owned_document(db, document_id, current_user.id)
+        if not document:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Document not found")
+
+        if document.processing_status in (DocumentStatus.COMPLETED, DocumentStatus.FAILED):
+            return _processing_status_response(document)
+        remaining = deadline - asyncio.get_running_loop().time()
+        if remaining <= 0:
+            return _processing_status_response(document)
+
+        # Hand the connection back to the pool while waiting; close() also empties the
+        # identity map, so the next iteration re-reads the status written by the worker.
+        await db.close()
+        await asyncio.sleep(min(settings.STATUS_LONG_POLL_INTERVAL_SECONDS, remaining))
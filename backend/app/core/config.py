@@ -9,7 +9,8 @@ class Settings(BaseSettings):
     # General App Settings
     PROJECT_NAME: str = "Fullstack RAG App"
     API_V1_STR: str = "/api/v1"
-    DEBUG_MODE: bool = True
+    DEBUG_MODE: bool = False
+    LOG_LEVEL: str = "INFO"
 
     # Database Settings
     POSTGRES_SERVER: str = "localhost"
@@ -18,6 +19,12 @@ class Settings(BaseSettings):
     POSTGRES_PASSWORD: str = "password" 
     POSTGRES_DB: str = "db" 
     DATABASE_URL: Optional[str] = None 
+    DB_ECHO: bool = False
+    DB_POOL_SIZE: int = 20
+    DB_MAX_OVERFLOW: int = 40
+    DB_POOL_RECYCLE_SECONDS: int = 1800
+    DB_STATEMENT_CACHE_SIZE: int = 1024
+    DB_PREPARED_STATEMENT_CACHE_SIZE: int = 512
 
     # Redis Settings (for Celery and caching)
     REDIS_HOST: str = "localhost"
@@ -25,12 +32,22 @@ class Settings(BaseSettings):
     REDIS_DB: int = 0
     CELERY_BROKER_URL: Optional[str] = None 
     CELERY_RESULT_BACKEND: Optional[str] = None 
+    PDF_PAGES_PER_SUBTASK: int = 300
+    TASK_STATUS_CACHE_TTL_SECONDS: float = 0.5
+    TASK_PROGRESS_MIN_INTERVAL_SECONDS: float = 1.0
+    STATUS_LONG_POLL_MAX_SECONDS: float = 30.0
+    STATUS_LONG_POLL_INTERVAL_SECONDS: float = 1.0
+    UPLOAD_WAIT_INITIAL_SECONDS: float = 0.5
+    UPLOAD_WAIT_INITIAL_INTERVAL_SECONDS: float = 0.1
 
     # S3/GCS Object Storage Settings
     AWS_ACCESS_KEY_ID: Optional[str] = None
     AWS_SECRET_ACCESS_KEY: Optional[str] = None
     AWS_REGION_NAME: Optional[str] = "us-east-1"
     S3_BUCKET_NAME: Optional[str] = "book-summarizer-pdfs"
+    S3_MULTIPART_CHUNK_SIZE: int = 8 * 1024 * 1024
+    S3_MAX_ATTEMPTS: int = 5
+    MAX_UPLOAD_BATCH_SIZE: int = 10
 
     # LLM Settings
     LLM_INFERENCE_SERVICE_URL: str = "http://localhost:8001/llm_inference" 
@@ -39,13 +56,62 @@ class Settings(BaseSettings):
     CHROMA_HOST: str = "localhost"
     CHROMA_PORT: int = 8000
     CHROMA_COLLECTION_NAME: str = "book_summarizer_embeddings"
+    CHROMA_ADD_BATCH_SIZE: int = 512
+    CHROMA_RETRY_ATTEMPTS: int = 5
+
+    # Embedding Settings
+    EMBEDDING_MAX_BATCH_SIZE: int = 64
+    EMBEDDING_BATCH_WAIT_MS: float = 5.0
+    EMBEDDING_EXECUTOR_WORKERS: int = 2
+    EMBEDDING_TORCH_NUM_THREADS: Optional[int] = None
+    EMBEDDING_ONNX_MODEL_PATH: Optional[str] = None
+    EMBEDDING_ONNX_MAX_SEQ_LENGTH: int = 128
+    EMBEDDING_DEVICE: Optional[str] = None
+    EMBEDDING_INGEST_BATCH_SIZE: int = 128
+    RAG_CHUNK_TOKENS: int = 256
+    RAG_CHUNK_OVERLAP_TOKENS: int = 40
+
+    # Reranker Settings
+    RERANK_CACHE_MAX_ENTRIES: int = 8192
+    RERANK_CACHE_TTL_SECONDS: float = 900.0
+    RERANK_SKIP_MAX_QUERY_WORDS: int = 3
+    RERANKER_DEVICE: Optional[str] = None
+    RERANKER_BATCH_SIZE: int = 32
+
+    # RAG context selection
+    RAG_INITIAL_RESULTS: int = 10
+    RAG_TOP_N: int = 5
+    RAG_SCORE_FLOOR: float = 0.3
+    RAG_LOCALIZED_SCORE: float = 0.9
+    RAG_MAX_CONTEXT_TOKENS: int = 3000
+
+    # Semantic query cache (per-document, in-process)
+    QUERY_CACHE_SIMILARITY_THRESHOLD: float = 0.97
+    QUERY_CACHE_MAX_ENTRIES: int = 512
+    QUERY_CACHE_MAX_DOCUMENTS: int = 128
+    QUERY_CACHE_TTL_SECONDS: float = 900.0
 
     # JWT Authentication settings
     SECRET_KEY: str
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 60
+    BCRYPT_ROUNDS: int = 12
+    PASSWORD_VERIFY_CACHE_TTL_SECONDS: float = 30.0
+    CURRENT_USER_CACHE_TTL_SECONDS: float = 60.0
+    # bcrypt (cost 12) of the dummy user's password "testpassword", precomputed so
+    # startup doesn't spend a hash on a fixed fixture.
+    DUMMY_USER_PASSWORD_HASH: str = "$2b$12$zfY9SdkWtSzGXeeQHvhFfOwZc2wOncmDYLduMD.tekqeeZjIxEf.u"
 
     COLLEGE_LLM_ENDPOINT: str = "http://localhost:8002"
+    LLM_MAX_CONNECTIONS: int = 256
+    LLM_MAX_KEEPALIVE_CONNECTIONS: int = 64
+    LLM_KEEPALIVE_EXPIRY_SECONDS: float = 60.0
+    LLM_TIMEOUT_SECONDS: float = 60.0
+    LLM_CONNECT_TIMEOUT_SECONDS: float = 10.0
+    LLM_HTTP2: bool = False
+    LLM_CONNECT_RETRIES: int = 2
+    LLM_CONCURRENCY: int = 8
+    LLM_RETRY_ATTEMPTS: int = 5
     
     # Model configuration for loading .env file
     model_config = SettingsConfigDict(env_file=".env", extra="ignore")
@@ -1,7 +1,9 @@
 # app/core/security.py
+import asyncio
+import hashlib
 from datetime import datetime, timedelta, timezone
 from typing import Optional
-from passlib.context import CryptContext
+import bcrypt
 from jose import jwt, JWTError
 from fastapi.security import OAuth2PasswordBearer
 from fastapi import Depends, HTTPException, status
@@ -10,17 +12,37 @@ from app.db.session import get_db
 from app.crud.user import get_user_by_email
 from app.db.models import User
 from app.core.config import settings
+from app.core.cache import TTLCache
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl=f"{settings.API_V1_STR}/auth/token")
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-1
-def verify_password(plain_password:str, hashed_password: str) -> bool:
+
+# Recent successful verifications, keyed by a digest of (hash, password), so
+# login retry storms do not each pay for a full bcrypt round.
+_verified_passwords = TTLCache(maxsize=1024, ttl=settings.PASSWORD_VERIFY_CACHE_TTL_SECONDS)
+
+# token -> (User, exp). Sessions use expire_on_commit=False, so the detached
+# User keeps its loaded attributes and can be handed to later requests.
+_current_user_cache = TTLCache(maxsize=4096, ttl=settings.CURRENT_USER_CACHE_TTL_SECONDS)
+
+def _password_bytes(password: str) -> bytes:
+    # bcrypt only uses the first 72 bytes; truncate as passlib did.
+    return password.encode("utf-8")[:72]
+
+async def verify_password(plain_password:str, hashed_password: str) -> bool:
     """Verify plain password against it's hashed version."""
-    return pwd_context.verify(plain_password, hashed_password)
+    cache_key = hashlib.sha256(f"{hashed_password}\0{plain_password}".encode("utf-8")).digest()
+    if _verified_passwords.get(cache_key):
+        return True
+    verified = await asyncio.to_thread(bcrypt.checkpw, _password_bytes(plain_password), hashed_password.encode("utf-8"))
+    if verified:
+        _verified_passwords.set(cache_key, True)
+    return verified
 
-def get_password_hash(password: str) -> str:
+async def get_password_hash(password: str) -> str:
     """Hash a plain password."""
-    return pwd_context.hash(password)
+    salt = bcrypt.gensalt(rounds=settings.BCRYPT_ROUNDS)
+    hashed = await asyncio.to_thread(bcrypt.hashpw, _password_bytes(password), salt)
+    return hashed.decode("utf-8")
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     """Create a JWT access token."""
@@ -54,6 +76,13 @@ async def get_current_user(
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+    cached = _current_user_cache.get(token)
+    if cached is not None:
+        user, expires_at = cached
+        if expires_at > datetime.now(timezone.utc).timestamp():
+            return user
+        _current_user_cache.pop(token)
+
     payload = decode_access_token(token)
     if payload is None:
         raise credentials_exception
@@ -69,6 +98,7 @@ async def get_current_user(
     if not user.is_active: 
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Inactive user")
 
+    _current_user_cache.set(token, (user, payload["exp"]))
     return user
 
     
@@ -1,36 +1,77 @@
 # app/crud/document.py
+import logging
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select
 from app.db.models import Document, User, DocumentStatus
 from app.schemas.document import DocumentCreate
-from typing import Optional
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
 
 async def create_document(
     db: AsyncSession,
     document_in: DocumentCreate,
-    file_path: str,
+    s3_object_key: str,
     file_size_bytes: int,
-    owner_id: int
+    owner_id: int,
+    celery_task_id: Optional[str] = None,
+    commit: bool = True
 ) -> Document:
     db_obj = Document(
         title=document_in.title,
-        file_path=file_path,
+        s3_object_key=s3_object_key,
         file_size_bytes=file_size_bytes,
         owner_id=owner_id,
-        processing_status=DocumentStatus.PENDING
+        processing_status=DocumentStatus.PENDING,
+        celery_task_id=celery_task_id
     )
     db.add(db_obj)
-    await db.commit()
-    await db.refresh(db_obj)
+    # Document uses eager_defaults, so the INSERT returns id/upload_timestamp
+    # and no follow-up refresh SELECT is needed.
+    if commit:
+        await db.commit()
+    else:
+        await db.flush()
     return db_obj
 
+async def create_documents(
+    db: AsyncSession,
+    documents_in: List[DocumentCreate],
+    s3_object_keys: List[str],
+    file_sizes_bytes: List[int],
+    owner_id: int,
+    celery_task_ids: List[str]
+) -> List[Document]:
+    """Stage several documents and flush them in one batched INSERT; the caller commits."""
+    db_objs = [
+        Document(
+            title=document_in.title,
+            s3_object_key=s3_object_key,
+            file_size_bytes=file_size_bytes,
+            owner_id=owner_id,
+            processing_status=DocumentStatus.PENDING,
+            celery_task_id=celery_task_id
+        )
+        for document_in, s3_object_key, file_size_bytes, celery_task_id
+        in zip(documents_in, s3_object_keys, file_sizes_bytes, celery_task_ids)
+    ]
+    db.add_all(db_objs)
+    await db.flush()
+    return db_objs
+
 async def delete_document(db: AsyncSession, document_id: int) -> None:
     document_to_delete = await db.get(Document, document_id)
     if document_to_delete:
         await db.delete(document_to_delete)
         await db.commit()
-        print(f"Deleted document: {document_to_delete}.")
+        logger.info(f"Deleted document: {document_to_delete}.")
     else:
-        print(f"Warning: Document with ID {document_id} not found for deletion in DB.")
+        logger.warning(f"Document with ID {document_id} not found for deletion in DB.")
 
 async def get_document_by_id(db: AsyncSession, document_id: int) -> Optional[Document]:
     return await db.get(Document, document_id)
+
+async def get_owned_document(db: AsyncSession, document_id: int, owner_id: int) -> Optional[Document]:
+    return await db.scalar(
+        select(Document).where(Document.id == document_id, Document.owner_id == owner_id)
+    )
@@ -1,5 +1,5 @@
 # app/db/models.py
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, Enum, Boolean
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, Enum, Boolean, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 import enum
@@ -31,17 +31,26 @@ class Document(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     title = Column(String, index=True, nullable=False)
-    file_path = Column(String, unique=True, nullable=False) 
+    s3_object_key = Column(String, unique=True, nullable=False)
     file_size_bytes = Column(Integer)
     upload_timestamp = Column(DateTime(timezone=True), server_default=func.now())
     processing_status = Column(Enum(DocumentStatus), default=DocumentStatus.PENDING, nullable=False)
     summary = Column(Text) 
     celery_task_id = Column(String, nullable=True, index=True)
     owner_id = Column(Integer, ForeignKey("users.id"))
-    owner = relationship("User", back_populates="documents")
+    # Lazy loads cannot run implicitly on an AsyncSession; fail loudly and
+    # eager-load with selectinload(Document.owner) where the owner is needed.
+    owner = relationship("User", back_populates="documents", lazy="raise_on_sql")
 
     chat_sessions = relationship("ChatSession", back_populates="document")
 
+    __mapper_args__ = {"eager_defaults": True}
+    # Serves list_documents (owner filter + newest first) as a single backward
+    # index range scan; owner_id lookups also use its leading column.
+    __table_args__ = (
+        Index("ix_documents_owner_uploaded", "owner_id", upload_timestamp.desc()),
+    )
+
 
 class ChatSession(Base):
     __tablename__ = "chat_sessions"
@@ -52,8 +61,8 @@ class ChatSession(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
 
-    user = relationship("User", back_populates="chat_sessions")
-    document = relationship("Document", back_populates="chat_sessions")
+    user = relationship("User", back_populates="chat_sessions", lazy="raise_on_sql")
+    document = relationship("Document", back_populates="chat_sessions", lazy="raise_on_sql")
     messages = relationship("ChatMessage", back_populates="session", order_by="ChatMessage.timestamp")
 
 
@@ -66,4 +75,4 @@ class ChatMessage(Base):
     content = Column(Text, nullable=False)
     timestamp = Column(DateTime(timezone=True), server_default=func.now())
 
-    session = relationship("ChatSession", back_populates="messages")
\ No newline at end of file
+    session = relationship("ChatSession", back_populates="messages", lazy="raise_on_sql")
\ No newline at end of file
@@ -2,12 +2,25 @@
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker, Session
 from sqlalchemy import create_engine
+from sqlalchemy.pool import NullPool
 from app.core.config import settings
 from contextlib import contextmanager
 
 from app.core.config import settings 
 
-engine = create_async_engine(settings.DATABASE_URL, echo=settings.DEBUG_MODE, future=True)
+engine = create_async_engine(
+    settings.DATABASE_URL,
+    echo=settings.DB_ECHO,
+    future=True,
+    pool_size=settings.DB_POOL_SIZE,
+    max_overflow=settings.DB_MAX_OVERFLOW,
+    pool_pre_ping=True,
+    pool_recycle=settings.DB_POOL_RECYCLE_SECONDS,
+    connect_args={
+        "statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE,
+        "prepared_statement_cache_size": settings.DB_PREPARED_STATEMENT_CACHE_SIZE,
+    },
+)
 
 AsyncSessionLocal = sessionmaker(
     autocommit=False,
@@ -21,7 +34,8 @@ async def get_db():
     async with AsyncSessionLocal() as session:
         yield session
 
-sync_engine = create_engine(settings.DATABASE_URL.replace("+asyncpg", ""), echo=False)
+# Used by Celery prefork workers; pooled connections must not be shared across forks.
+sync_engine = create_engine(settings.DATABASE_URL.replace("+asyncpg", ""), echo=False, poolclass=NullPool)
 SyncSessionLocal = sessionmaker(
     autocommit=False,
     autoflush=False,
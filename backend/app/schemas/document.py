@@ -14,7 +14,7 @@ class DocumentCreate(DocumentBase):
 
 class DocumentResponse(DocumentBase):
     id: int
-    file_path: str
+    s3_object_key: str
     file_size_bytes: Optional[int] = None
     upload_timestamp: datetime
     processing_status: DocumentStatus
@@ -22,4 +22,9 @@ class DocumentResponse(DocumentBase):
     owner_id: int
 
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+class DocumentUploadResponse(DocumentResponse):
+    # Only set for /upload?wait_initial=1, once the worker has picked the task up.
+    celery_state: Optional[str] = None
+    processing_started_at: Optional[datetime] = None
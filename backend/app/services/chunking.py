@@ -0,0 +1,32 @@
+# app/services/chunking.py
+from typing import Callable, List
+
+from langchain_text_splitters import TextSplitter
+
+
+def merge_small_chunks(chunks: List[str], min_size: int, max_size: int,
+                       length_function: Callable[[str], int], separator: str = "\n\n") -> List[str]:
+    """Fold chunks shorter than min_size into a neighbour, never growing a chunk past max_size."""
+    merged: List[str] = []
+    for chunk in chunks:
+        if merged:
+            previous = merged[-1]
+            if length_function(previous) < min_size or length_function(chunk) < min_size:
+                candidate = previous + separator + chunk
+                if length_function(candidate) <= max_size:
+                    merged[-1] = candidate
+                    continue
+        merged.append(chunk)
+    return merged
+
+
+def resplit_large_chunks(chunks: List[str], max_size: int, splitter: TextSplitter,
+                         length_function: Callable[[str], int]) -> List[str]:
+    """Send chunks longer than max_size back through the splitter's separator cascade."""
+    resplit: List[str] = []
+    for chunk in chunks:
+        if length_function(chunk) > max_size:
+            resplit.extend(splitter.split_text(chunk))
+        else:
+            resplit.append(chunk)
+    return resplit
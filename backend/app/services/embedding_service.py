@@ -1,42 +1,239 @@
 # app/services/embedding_service.py
+import asyncio
+import hashlib
 import logging
-from typing import List
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
 from sentence_transformers import SentenceTransformer
+import numpy as np
 import torch
 
+from app.core.config import settings
+
 logger = logging.getLogger(__name__)
 
+EMBED_POOL = ThreadPoolExecutor(max_workers=settings.EMBEDDING_EXECUTOR_WORKERS, thread_name_prefix="embed")
+
+if settings.EMBEDDING_TORCH_NUM_THREADS:
+    torch.set_num_threads(settings.EMBEDDING_TORCH_NUM_THREADS)
+
+class EmbeddingCache:
+    """LRU cache of embeddings keyed by the SHA-256 digest of the input text."""
+
+    def __init__(self, maxsize: int = 10_000):
+        self.maxsize = maxsize
+        self._store: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(text: str) -> str:
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def get(self, text: str) -> Optional[np.ndarray]:
+        key = self._key(text)
+        with self._lock:
+            embedding = self._store.get(key)
+            if embedding is not None:
+                self._store.move_to_end(key)
+        return embedding
+
+    def put(self, text: str, embedding: np.ndarray) -> None:
+        key = self._key(text)
+        with self._lock:
+            self._store[key] = embedding
+            self._store.move_to_end(key)
+            if len(self._store) > self.maxsize:
+                self._store.popitem(last=False)
+
+class OnnxSentenceEncoder:
+    """Drop-in replacement for SentenceTransformer.encode backed by an ONNX Runtime session."""
+
+    def __init__(self, model_path: str, tokenizer_name: str, max_seq_length: int = 128):
+        import onnxruntime
+        from transformers import AutoTokenizer
+
+        self.session = onnxruntime.InferenceSession(model_path, providers=["CPUExecutionProvider"])
+        self.tokenizer = AutoTokenizer.from_pretrained(tokenizer_name)
+        self.max_seq_length = max_seq_length
+        self._input_names = [i.name for i in self.session.get_inputs()]
+
+    def encode(self, texts: List[str], batch_size: int = 32, **kwargs) -> np.ndarray:
+        outputs = []
+        for start in range(0, len(texts), batch_size):
+            batch = self.tokenizer(
+                texts[start:start + batch_size],
+                padding="max_length",
+                truncation=True,
+                max_length=self.max_seq_length,
+                return_tensors="np",
+            )
+            feeds = {name: batch[name].astype(np.int64) for name in self._input_names}
+            token_embeddings = self.session.run(None, feeds)[0]
+
+            # Mean pooling over non-padding tokens, then L2 normalization.
+            mask = batch["attention_mask"][..., np.newaxis].astype(np.float32)
+            pooled = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+            outputs.append(pooled.astype(np.float32))
+        if not outputs:
+            return np.empty((0, 0), dtype=np.float32)
+        return np.vstack(outputs)
+
 class EmbeddingService:
     def __init__(self, model_name: str = "all-MiniLM-L6-v2"):
         self.model_name = model_name
         self.model = None
+        self.cache = EmbeddingCache()
+        self.max_batch_size = settings.EMBEDDING_MAX_BATCH_SIZE
+        self.batch_wait_seconds = settings.EMBEDDING_BATCH_WAIT_MS / 1000
+        self._queue: Optional[asyncio.Queue] = None
+        self._batch_worker: Optional[asyncio.Task] = None
         self._load_model()
-    
+
     def _load_model(self):
+        if settings.EMBEDDING_ONNX_MODEL_PATH:
+            try:
+                tokenizer_name = self.model_name if "/" in self.model_name else f"sentence-transformers/{self.model_name}"
+                logger.info(f"Attempting to load ONNX embedding model: {settings.EMBEDDING_ONNX_MODEL_PATH}.")
+                self.model = OnnxSentenceEncoder(
+                    settings.EMBEDDING_ONNX_MODEL_PATH,
+                    tokenizer_name,
+                    max_seq_length=settings.EMBEDDING_ONNX_MAX_SEQ_LENGTH,
+                )
+                logger.info(f"Successfully loaded ONNX embedding model: {settings.EMBEDDING_ONNX_MODEL_PATH}.")
+                return
+            except Exception as e:
+                logger.error(f"Failed to load ONNX embedding model, falling back to Sentence Transformer: {e}")
         try:
             logger.info(f"Attempting to load Sentence Transformer model: {self.model_name}.")
-            self.model = SentenceTransformer(self.model_name)
-            logger.info(f"Successfully loaded Sentence Transformer model: {self.model_name}.")
+            device = settings.EMBEDDING_DEVICE or ("cuda" if torch.cuda.is_available() else "cpu")
+            self.model = SentenceTransformer(self.model_name, device=device)
+            if device.startswith("cuda"):
+                # FP16 halves activation memory traffic; cosine ranking is unaffected.
+                self.model.half()
+            logger.info(f"Successfully loaded Sentence Transformer model: {self.model_name} on {device}.")
         except Exception as e:
             logger.error(f"Failed to load Sentence Transformer model: {self.model_name}.")
             self.model = None
 
-    def get_embeddings(self, texts: List[str]) -> List[List[float]]:
+    def get_embeddings(self, texts: List[str], batch_size: Optional[int] = None) -> Optional[np.ndarray]:
         if self.model is None:
             logger.error("Embedding model not loaded. Cannot generate embeddings.")
-            return []
+            return None
         try:
-            embeddings = self.model.encode(texts, convert_to_numpy=False)
-            logger.info(f"Generated {len(embeddings)} embeddings.")
-
-            if isinstance(embeddings, torch.Tensor):
-                return embeddings.tolist()
-            elif isinstance(embeddings, list) and all(isinstance(e, torch.Tensor) for e in embeddings):
-                return [e.tolist() for e in embeddings]
-            else:
-                return embeddings
+            # Repeated chunks (running headers, footers, TOC lines) are encoded once
+            # and scattered back to every position they occur at.
+            unique_index = {text: i for i, text in enumerate(dict.fromkeys(texts))}
+            embeddings = self.model.encode(
+                list(unique_index),
+                batch_size=batch_size or self.max_batch_size,
+                convert_to_numpy=True,
+                normalize_embeddings=True,
+                show_progress_bar=False,
+            )
+            logger.info(f"Generated {len(embeddings)} embeddings for {len(texts)} texts.")
+            if len(unique_index) != len(texts):
+                embeddings = embeddings[[unique_index[text] for text in texts]]
+            return np.ascontiguousarray(embeddings, dtype=np.float32)
         except Exception as e:
             logger.error(f"Failed to generate embeddings: {e}")
+            return None
+
+    def split_into_token_windows(self, text: str, window_tokens: int, overlap_tokens: int) -> Optional[List[str]]:
+        """
+        Split text into overlapping windows of the embedding model's own tokens, using a
+        single tokenizer pass and its character offsets. Returns None if no tokenizer is loaded.
+        """
+        tokenizer = getattr(self.model, "tokenizer", None)
+        if tokenizer is None:
+            return None
+        # Leave room for the [CLS]/[SEP] tokens so no window is truncated at encode time.
+        window_tokens = min(window_tokens, self.model.max_seq_length - 2)
+        step = max(window_tokens - overlap_tokens, 1)
+
+        offsets = tokenizer(text, return_offsets_mapping=True, add_special_tokens=False)["offset_mapping"]
+        chunks = []
+        for start in range(0, len(offsets), step):
+            # The last window may be shorter; it overlaps the previous one by exactly overlap_tokens.
+            end = min(start + window_tokens, len(offsets))
+            chunk = text[offsets[start][0]:offsets[end - 1][1]]
+            if chunk.strip():
+                chunks.append(chunk)
+            if end == len(offsets):
+                break
+        return chunks
+
+    def get_embeddings_cached(self, texts: List[str]) -> List[np.ndarray]:
+        if self.model is None:
+            logger.error("Embedding model not loaded. Cannot generate embeddings.")
             return []
-    
-embedding_service = EmbeddingService()
\ No newline at end of file
+
+        results: List[Optional[np.ndarray]] = [self.cache.get(text) for text in texts]
+        miss_indices = [i for i, embedding in enumerate(results) if embedding is None]
+        if not miss_indices:
+            logger.info(f"Served {len(texts)} embeddings from cache.")
+            return results
+
+        miss_texts = [texts[i] for i in miss_indices]
+        miss_embeddings = self.get_embeddings(miss_texts)
+        if miss_embeddings is None:
+            return []
+        logger.info(f"Generated {len(miss_texts)} embeddings ({len(texts) - len(miss_texts)} cache hits).")
+
+        for i, embedding in zip(miss_indices, miss_embeddings):
+            # Cached vectors are shared by every caller, so store read-only copies.
+            embedding = embedding.copy()
+            embedding.setflags(write=False)
+            self.cache.put(texts[i], embedding)
+            results[i] = embedding
+        return results
+
+    async def aget_embeddings(self, texts: List[str]) -> List[np.ndarray]:
+        return await asyncio.get_running_loop().run_in_executor(EMBED_POOL, self.get_embeddings_cached, texts)
+
+    async def embed(self, text: str) -> Optional[np.ndarray]:
+        """Embed a single text, coalescing concurrent callers into one forward pass."""
+        cached = self.cache.get(text)
+        if cached is not None:
+            return cached
+
+        if self._batch_worker is None or self._batch_worker.done():
+            self._queue = asyncio.Queue()
+            self._batch_worker = asyncio.create_task(self._run_batch_worker(self._queue))
+
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((text, future))
+        return await future
+
+    async def _run_batch_worker(self, queue: asyncio.Queue):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch: List[Tuple[str, asyncio.Future]] = [await queue.get()]
+            deadline = loop.time() + self.batch_wait_seconds
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            # encode() sorts its input by length internally, so mixed-length
+            # queries are padded per mini-batch rather than to the longest text.
+            try:
+                embeddings = await self.aget_embeddings([text for text, _ in batch])
+            except Exception as e:
+                # Fail this batch's callers but keep serving the rest of the queue.
+                logger.error(f"Failed to embed batch of {len(batch)} queries: {e}")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for i, (_, future) in enumerate(batch):
+                if not future.done():
+                    future.set_result(embeddings[i] if embeddings else None)
+
+embedding_service = EmbeddingService()
@@ -1,27 +1,124 @@
 # app/services/llm_service.py
+import asyncio
 import httpx
 import logging
+import orjson
+from functools import lru_cache
+from tenacity import AsyncRetrying, retry_if_exception, stop_after_attempt, wait_exponential_jitter
 from typing import Optional, Dict, Any, List
-from transformers import AutoTokenizer
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 
 from app.core.config import settings
+from app.services.chunking import merge_small_chunks, resplit_large_chunks
 
 logger = logging.getLogger(__name__)
 
+TOKENIZER_NAME = "mistralai/Mistral-7B-Instruct-v0.2"
+INST_END_TAG = "[/INST]"
+# Longer texts (whole sections, merged summaries, prompts) are rarely counted twice,
+# so they bypass the cache instead of being pinned in long-lived workers.
+TOKEN_COUNT_CACHE_MAX_CHARS = 2048
+
+# Prompt templates split around their variable parts, so each prompt is built with one join.
+DIRECT_SUMMARY_PROMPT_PREFIX = (
+    "[INST] Provide a comprehensive and detailed summary of the following document. Cover all main points, "
+    "key arguments, and the overall conclusion thoroughly. The summary should be easy to understand and "
+    "provide a complete overview of the content.\n\nDocument:\n"
+)
+DIRECT_SUMMARY_PROMPT_SUFFIX = "\n\nComprehensive Document Summary: [/INST]"
+
+SECTION_SUMMARY_PROMPT_PREFIX = (
+    "[INST] Summarize the following section of a larger document. Focus on the main points and key information "
+    "presented in this specific section. Ensure it is a self-contained summary of THIS section only. Do not "
+    "provide a conclusion for the entire document or transition phrases that suggest continuation from previous "
+    "sections. **Do not mention the section of the document you are summarizing (e.g., \"In Section X\").**"
+    "\n\nSection "
+)
+SECTION_SUMMARY_PROMPT_MID = ":\n"
+SECTION_SUMMARY_PROMPT_LABEL = "\n\nSection "
+SECTION_SUMMARY_PROMPT_SUFFIX = " Summary: [/INST]"
+
+REDUCE_SUMMARY_PROMPT_PREFIX = (
+    "[INST] You have been provided with several summaries of different sections of a single large document."
+    "\n\nYour primary task is to **synthesize these individual summaries into one comprehensive, detailed, and "
+    "cohesive summary of the entire document.**"
+    "\n\n**Crucially, remove all references to specific sections or chapters (e.g., \"In Section X\", "
+    "\"Chapter Y discusses\"). Integrate the information smoothly as if it were a single narrative.**"
+    "\n\nEnsure a logical flow, integrate the main ideas from all sections, and avoid redundancy. Provide a "
+    "thorough overview that captures the essence and key insights of the full content."
+    "\n\nSection Summaries:\n"
+)
+REDUCE_SUMMARY_PROMPT_SUFFIX = "\n\nComprehensive Document Summary: [/INST]"
+
+
+def _section_summary_prompt(section_number: int, chunk: str) -> str:
+    label = str(section_number)
+    return "".join((
+        SECTION_SUMMARY_PROMPT_PREFIX, label, SECTION_SUMMARY_PROMPT_MID, chunk,
+        SECTION_SUMMARY_PROMPT_LABEL, label, SECTION_SUMMARY_PROMPT_SUFFIX,
+    ))
+
+@lru_cache(maxsize=1)
+def _get_tokenizer():
+    # Loaded on first exact count, so importing the service doesn't pull in transformers.
+    from transformers import AutoTokenizer
+    return AutoTokenizer.from_pretrained(TOKENIZER_NAME, use_fast=True)
+
+def _count_tokens(text: str) -> int:
+    return len(_get_tokenizer()(text, add_special_tokens=False)["input_ids"])
+
+_count_tokens_cached = lru_cache(maxsize=4096)(_count_tokens)
+
+def _is_transient_http_error(exc: BaseException) -> bool:
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code == 429 or exc.response.status_code >= 500
+    return isinstance(exc, httpx.RequestError)
+
 class LLMService:
     def __init__(self):
-        self.client = httpx.AsyncClient(base_url=settings.COLLEGE_LLM_ENDPOINT, timeout=60.0)
-        self.tokenizer = AutoTokenizer.from_pretrained("mistralai/Mistral-7B-Instruct-v0.2")
+        # One pooled client for the process; the transport retries failed connection
+        # attempts instead of callers re-opening sockets. LLM_HTTP2 requires the h2 package.
+        limits = httpx.Limits(
+            max_connections=settings.LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.LLM_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=settings.LLM_KEEPALIVE_EXPIRY_SECONDS,
+        )
+        self.client = httpx.AsyncClient(
+            base_url=settings.COLLEGE_LLM_ENDPOINT,
+            timeout=httpx.Timeout(settings.LLM_TIMEOUT_SECONDS, connect=settings.LLM_CONNECT_TIMEOUT_SECONDS),
+            transport=httpx.AsyncHTTPTransport(
+                http2=settings.LLM_HTTP2,
+                limits=limits,
+                retries=settings.LLM_CONNECT_RETRIES,
+            ),
+        )
+        # Approximate token cost of each prompt template without its content.
+        self._overhead_direct = self._estimate_tokens(DIRECT_SUMMARY_PROMPT_PREFIX + DIRECT_SUMMARY_PROMPT_SUFFIX)
+        self._overhead_section = self._estimate_tokens(_section_summary_prompt(999, ""))
+        self._overhead_reduce = self._estimate_tokens(REDUCE_SUMMARY_PROMPT_PREFIX + REDUCE_SUMMARY_PROMPT_SUFFIX)
         logger.info(f"LLMService initialized. Connecting to LLM at: {settings.COLLEGE_LLM_ENDPOINT}.")
 
+    async def aclose(self):
+        await self.client.aclose()
+
+    @property
+    def tokenizer(self):
+        return _get_tokenizer()
+
     def count_tokens(self, text: str) -> int:
-        return len(self.tokenizer.encode(text))
+        if len(text) > TOKEN_COUNT_CACHE_MAX_CHARS:
+            return _count_tokens(text)
+        return _count_tokens_cached(text)
+
+    def _estimate_tokens(self, text: str) -> int:
+        """~3.5 characters per token; for sizing decisions that don't need the real tokenizer."""
+        return (len(text) * 2) // 7
 
     def _words_to_tokens(self, words: int) -> int:
         return int(words * 1.3)
     
-    async def generate_text(self, prompt: str, max_tokens: int = 1000, temperature: float = 0.7) -> Optional[str]:
+    async def generate_text(self, prompt: str, max_tokens: int = 1000, temperature: float = 0.7,
+                            max_attempts: int = 1) -> Optional[str]:
         if not self.client:
             logger.error("LLMService client not initialized.")
             return None
@@ -39,14 +136,25 @@ class LLMService:
         }
 
         try:
-            response = await self.client.post("/generate", headers=headers, json=payload)
-            response.raise_for_status()
-            response_data = response.json()
+            # Batch callers opt in to backing off and retrying timeouts, dropped connections,
+            # 429s and 5xx; interactive callers keep the default single attempt.
+            async for attempt in AsyncRetrying(
+                retry=retry_if_exception(_is_transient_http_error),
+                wait=wait_exponential_jitter(initial=1, max=30),
+                stop=stop_after_attempt(max_attempts),
+                reraise=True,
+            ):
+                with attempt:
+                    response = await self.client.post("/generate", headers=headers, json=payload)
+                    response.raise_for_status()
+            response_data = orjson.loads(response.content)
 
             if "text" in response_data and isinstance(response_data["text"], list) and len(response_data["text"]) > 0:
                 generated_text = response_data["text"][0]
-                logger.info(f"Successfully generated text from LLM. Generated tokens: {self.count_tokens(generated_text)}")
-                return generated_text.split("[/INST]")[1] if "[/INST]" in generated_text else generated_text
+                logger.info(f"Successfully generated text from LLM. Generated tokens (approx.): {self._estimate_tokens(generated_text)}")
+                # vLLM echoes the prompt; the answer follows the first [/INST].
+                inst_end = generated_text.find(INST_END_TAG)
+                return generated_text[inst_end + len(INST_END_TAG):] if inst_end >= 0 else generated_text
             else:
                 logger.warning(f"Unexpected response format from LLM: {response_data}")
                 return None
@@ -64,31 +172,16 @@ class LLMService:
             return None
         
     async def generate_summary(self, text_content: str, max_input_tokens: int = 30000,
-                               words_per_chunk_summary: int = 100) -> Optional[str]:
+                               words_per_chunk_summary: int = 100, max_attempts: int = 1) -> Optional[str]:
         
-        base_prompt_overhead_direct = self.count_tokens(
-            "[INST] Provide a comprehensive and detailed summary of the following document. Cover all main points, key arguments, and the overall conclusion thoroughly. The summary should be easy to understand and provide a complete overview of the content.\n\nDocument:\n\nComprehensive Document Summary: [/INST]"
-        )
-        base_prompt_overhead_section = self.count_tokens(
-            "[INST] Summarize the following section of a larger document. Focus on the main points and key information presented in this specific section. Ensure it is a self-contained summary of THIS section only. Do not provide a conclusion for the entire document or transition phrases that suggest continuation from previous sections. Do not mention the section of the document you are summarizing.\n\nSection X:\n\nSection X Summary: [/INST]"
-        )
-        base_prompt_overhead_reduce = self.count_tokens(
-            "[INST] You have been provided with several summaries of different sections of a single large document. Your primary task is to synthesize these individual summaries into one comprehensive, detailed, and cohesive summary of the entire document. Crucially, remove all references to specific sections or chapters (e.g., \"In Section X\", \"Chapter Y discusses\"). Integrate the information smoothly as if it were a single narrative. Ensure a logical flow, integrate the main ideas from all sections, and avoid redundancy. Provide a thorough overview that captures the essence and key insights of the full content.\n\nSection Summaries:\n\nComprehensive Document Summary: [/INST]"
-        )
-
-        effective_content_limit_for_splitting = max_input_tokens - max(base_prompt_overhead_direct, base_prompt_overhead_section, base_prompt_overhead_reduce)
+        effective_content_limit_for_splitting = max_input_tokens - max(self._overhead_direct, self._overhead_section, self._overhead_reduce)
         
         if self.count_tokens(text_content) <= effective_content_limit_for_splitting:
-            prompt = f"""[INST] Provide a comprehensive and detailed summary of the following document. Cover all main points, key arguments, and the overall conclusion thoroughly. The summary should be easy to understand and provide a complete overview of the content.
-
-            Document:
-            {text_content}
-
-            Comprehensive Document Summary: [/INST]"""
+            prompt = "".join((DIRECT_SUMMARY_PROMPT_PREFIX, text_content, DIRECT_SUMMARY_PROMPT_SUFFIX))
             
             direct_summary_max_tokens = self._words_to_tokens(words_per_chunk_summary * 2) 
             logger.info("Generating direct summary (text fits token limit)...")
-            summary = await self.generate_text(prompt, max_tokens=direct_summary_max_tokens)
+            summary = await self.generate_text(prompt, max_tokens=direct_summary_max_tokens, max_attempts=max_attempts)
             return summary
         else:
             logger.info("Text exceeds token limit. Initiating recursive summarization.")
@@ -102,30 +195,45 @@ class LLMService:
                 length_function=self.count_tokens,
                 is_separator_regex=False,
             )
-            chunks = text_splitter.split_text(text_content)
+            chunks = merge_small_chunks(
+                text_splitter.split_text(text_content),
+                min_size=chunk_size_for_summarization // 10,
+                max_size=chunk_size_for_summarization,
+                length_function=self.count_tokens,
+            )
+            chunks = resplit_large_chunks(
+                chunks, max_size=chunk_size_for_summarization, splitter=text_splitter, length_function=self.count_tokens
+            )
             logger.info(f"Split document into {len(chunks)} chunks for summarization.")
 
             max_tokens_per_chunk_summary = self._words_to_tokens(words_per_chunk_summary)
 
-            summaries = []
-            for i, chunk in enumerate(chunks):
-                chunk_summary_prompt = f"""[INST] Summarize the following section of a larger document. Focus on the main points and key information presented in this specific section. Ensure it is a self-contained summary of THIS section only. Do not provide a conclusion for the entire document or transition phrases that suggest continuation from previous sections. **Do not mention the section of the document you are summarizing (e.g., "In Section X").**
+            chunk_summary_prompts = [_section_summary_prompt(i + 1, chunk) for i, chunk in enumerate(chunks)]
+            # One batched call into the Rust tokenizer instead of an encode per prompt.
+            prompt_token_lengths = self.tokenizer(
+                chunk_summary_prompts, return_length=True, add_special_tokens=False
+            )["length"]
+            semaphore = asyncio.Semaphore(settings.LLM_CONCURRENCY)
 
-                Section {i+1}:
-                {chunk}
+            async def summarize_chunk(i: int, chunk_summary_prompt: str) -> Optional[str]:
+                async with semaphore:
+                    logger.info(f"Summarizing chunk {i+1}/{len(chunks)} with max_tokens={max_tokens_per_chunk_summary}...")
+                    chunk_summary = await self.generate_text(
+                        chunk_summary_prompt, max_tokens=max_tokens_per_chunk_summary, max_attempts=max_attempts
+                    )
+                if not chunk_summary:
+                    logger.warning(f"Failed to generate summary for chunk {i+1}.")
+                return chunk_summary
 
-                Section {i+1} Summary: [/INST]"""
-                
-                if self.count_tokens(chunk_summary_prompt) > max_input_tokens:
+            pending_summaries = []
+            for i, (chunk_summary_prompt, prompt_tokens) in enumerate(zip(chunk_summary_prompts, prompt_token_lengths)):
+                if prompt_tokens > max_input_tokens:
                     logger.warning(f"Chunk {i+1} with its prompt still exceeds max_input_tokens after initial splitting. This might lead to issues or requires further splitting. Skipping this chunk for summarization for now.")
                     continue 
-                
-                logger.info(f"Summarizing chunk {i+1}/{len(chunks)} with max_tokens={max_tokens_per_chunk_summary}...")
-                chunk_summary = await self.generate_text(chunk_summary_prompt, max_tokens=max_tokens_per_chunk_summary)
-                if chunk_summary:
-                    summaries.append(chunk_summary)
-                else:
-                    logger.warning(f"Failed to generate summary for chunk {i+1}.")
+                pending_summaries.append(summarize_chunk(i, chunk_summary_prompt))
+
+            # gather keeps section order, so the reduce prompt reads front to back.
+            summaries = [summary for summary in await asyncio.gather(*pending_summaries) if summary]
 
             if not summaries:
                 logger.error("No summaries generated for any chunk.")
@@ -139,22 +247,12 @@ class LLMService:
                 final_summary = await self.generate_summary(
                     combined_summaries_text, 
                     max_input_tokens=max_input_tokens, 
-                    words_per_chunk_summary=words_per_chunk_summary
+                    words_per_chunk_summary=words_per_chunk_summary,
+                    max_attempts=max_attempts
                 )
                 return final_summary
             else:
-                final_reduce_prompt = f"""[INST] You have been provided with several summaries of different sections of a single large document.
-
-                Your primary task is to **synthesize these individual summaries into one comprehensive, detailed, and cohesive summary of the entire document.**
-
-                **Crucially, remove all references to specific sections or chapters (e.g., \"In Section X\", \"Chapter Y discusses\"). Integrate the information smoothly as if it were a single narrative.**
-
-                Ensure a logical flow, integrate the main ideas from all sections, and avoid redundancy. Provide a thorough overview that captures the essence and key insights of the full content.
-
-                Section Summaries:
-                {combined_summaries_text}
-
-                Comprehensive Document Summary: [/INST]"""
+                final_reduce_prompt = "".join((REDUCE_SUMMARY_PROMPT_PREFIX, combined_summaries_text, REDUCE_SUMMARY_PROMPT_SUFFIX))
                 
                 desired_total_summary_words = len(chunks) * words_per_chunk_summary
                 max_final_summary_tokens_cap = 3000 
@@ -162,7 +260,9 @@ class LLMService:
                 final_summary_max_tokens = min(self._words_to_tokens(desired_total_summary_words), max_final_summary_tokens_cap)
 
                 logger.info(f"Generating final summary from combined chunk summaries with max_tokens={final_summary_max_tokens}...")
-                final_summary = await self.generate_text(final_reduce_prompt, max_tokens=final_summary_max_tokens)
+                final_summary = await self.generate_text(
+                    final_reduce_prompt, max_tokens=final_summary_max_tokens, max_attempts=max_attempts
+                )
                 parts = final_summary.rsplit('.', 1)
                 return parts[0].strip() + "."
 
@@ -0,0 +1,101 @@
+# app/services/query_cache_service.py
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+import numpy as np
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+class _DocumentQueryCache:
+    """Fixed-capacity matrix of normalized query embeddings for one indexed version of a document."""
+
+    def __init__(self, capacity: int, dim: int, version: Optional[str]):
+        self.version = version
+        self.embeddings = np.zeros((capacity, dim), dtype=np.float32)
+        self.payloads: List[Optional[Dict[str, Any]]] = [None] * capacity
+        self.last_used = np.zeros(capacity, dtype=np.int64)
+        self.expires_at = np.zeros(capacity, dtype=np.float64)
+        self.size = 0
+
+    def lookup(self, query: np.ndarray, threshold: float, tick: int) -> Optional[Dict[str, Any]]:
+        if self.size == 0:
+            return None
+        sims = np.dot(self.embeddings[:self.size], query)
+        sims[self.expires_at[:self.size] <= time.monotonic()] = -np.inf
+        best = int(np.argmax(sims))
+        if sims[best] < threshold:
+            return None
+        self.last_used[best] = tick
+        return self.payloads[best]
+
+    def insert(self, query: np.ndarray, payload: Dict[str, Any], tick: int, expires_at: float) -> None:
+        if self.size < len(self.payloads):
+            slot = self.size
+            self.size += 1
+        else:
+            slot = int(np.argmin(self.last_used))
+        self.embeddings[slot] = query
+        self.payloads[slot] = payload
+        self.last_used[slot] = tick
+        self.expires_at[slot] = expires_at
+
+class QueryCacheService:
+    def __init__(self, max_entries_per_document: int, max_documents: int, similarity_threshold: float,
+                 ttl_seconds: float):
+        self.max_entries_per_document = max_entries_per_document
+        self.max_documents = max_documents
+        self.similarity_threshold = similarity_threshold
+        self.ttl_seconds = ttl_seconds
+        self._documents: "OrderedDict[int, _DocumentQueryCache]" = OrderedDict()
+        self._tick = 0
+
+    @staticmethod
+    def _normalize(embedding) -> Optional[np.ndarray]:
+        query = np.asarray(embedding, dtype=np.float32).ravel()
+        norm = np.linalg.norm(query)
+        if norm == 0:
+            return None
+        return query / norm
+
+    def lookup(self, document_id: int, embedding, version: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """``version`` identifies the indexing run (e.g. its task id); answers from other runs are dropped."""
+        cache = self._documents.get(document_id)
+        query = self._normalize(embedding)
+        if cache is None or query is None:
+            return None
+        if cache.version != version:
+            self.invalidate(document_id)
+            return None
+        self._tick += 1
+        self._documents.move_to_end(document_id)
+        payload = cache.lookup(query, self.similarity_threshold, self._tick)
+        if payload is not None:
+            logger.info(f"Semantic query cache hit for document {document_id}.")
+        return payload
+
+    def store(self, document_id: int, embedding, payload: Dict[str, Any], version: Optional[str] = None) -> None:
+        query = self._normalize(embedding)
+        if query is None:
+            return
+        cache = self._documents.get(document_id)
+        if cache is None or cache.version != version:
+            cache = _DocumentQueryCache(self.max_entries_per_document, query.shape[0], version)
+            self._documents[document_id] = cache
+            if len(self._documents) > self.max_documents:
+                self._documents.popitem(last=False)
+        self._documents.move_to_end(document_id)
+        self._tick += 1
+        cache.insert(query, payload, self._tick, time.monotonic() + self.ttl_seconds)
+
+    def invalidate(self, document_id: int) -> None:
+        self._documents.pop(document_id, None)
+
+query_cache_service = QueryCacheService(
+    max_entries_per_document=settings.QUERY_CACHE_MAX_ENTRIES,
+    max_documents=settings.QUERY_CACHE_MAX_DOCUMENTS,
+    similarity_threshold=settings.QUERY_CACHE_SIMILARITY_THRESHOLD,
+    ttl_seconds=settings.QUERY_CACHE_TTL_SECONDS,
+)
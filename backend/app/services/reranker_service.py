@@ -1,20 +1,40 @@
 # app/services/reranker_service.py
+import asyncio
+import hashlib
+import inspect
 import logging
 from typing import List, Dict, Any, Optional
 from sentence_transformers import CrossEncoder
+import numpy as np
+import torch
+
+from app.core.cache import TTLCache
+from app.core.config import settings
 
 logger = logging.getLogger(__name__)
 
 RERANKER_MODEL_NAME = 'cross-encoder/ms-marco-MiniLM-L-6-v2' 
+# The model's config sets an Identity activation, so predict() returns raw logits
+# unless a sigmoid is passed explicitly. The keyword was renamed in sentence-transformers 4.
+_ACTIVATION_KWARG = "activation_fn" if "activation_fn" in inspect.signature(CrossEncoder.predict).parameters else "activation_fct"
 
 class ReRankerService:
     def __init__(self):
         try:
-            self.model = CrossEncoder(RERANKER_MODEL_NAME)
-            logger.info(f"ReRankerService initialized. Loaded model: {RERANKER_MODEL_NAME}")
+            device = settings.RERANKER_DEVICE or ("cuda" if torch.cuda.is_available() else "cpu")
+            self.model = CrossEncoder(RERANKER_MODEL_NAME, device=device)
+            if device.startswith("cuda"):
+                self.model.model.half()
+            logger.info(f"ReRankerService initialized. Loaded model: {RERANKER_MODEL_NAME} on {device}")
         except Exception as e:
             logger.error(f"Failed to load re-ranker model {RERANKER_MODEL_NAME}: {e}")
             self.model = None
+        self.cache = TTLCache(maxsize=settings.RERANK_CACHE_MAX_ENTRIES, ttl=settings.RERANK_CACHE_TTL_SECONDS)
+
+    @staticmethod
+    def _cache_key(query: str, documents: List[Dict[str, Any]], top_n: int):
+        query_digest = hashlib.blake2b(query.encode(), digest_size=16).digest()
+        return query_digest, tuple(sorted(doc['id'] for doc in documents)), top_n
 
     async def rerank(self, query: str, documents: List[Dict[str, Any]], top_n: int = 3) -> List[Dict[str, Any]]:
         if self.model is None:
@@ -24,21 +44,42 @@ class ReRankerService:
         if not documents:
             return []
 
+        # Keyword-style queries carry too little context for the cross-encoder
+        # to beat the retrieval order, so keep Chroma's ranking.
+        if len(query.split()) <= settings.RERANK_SKIP_MAX_QUERY_WORDS:
+            return documents[:top_n]
+
+        cache_key = self._cache_key(query, documents, top_n)
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            logger.info(f"Served re-ranking of {len(documents)} documents from cache.")
+            return list(cached)
+
         sentences_to_rerank = [(query, doc['document']) for doc in documents]
 
         try:
-            scores = self.model.predict(sentences_to_rerank)
-
-            scored_documents = []
-            for i, doc in enumerate(documents):
-                doc_with_score = doc.copy()
-                doc_with_score['relevance_score'] = float(scores[i]) 
-                scored_documents.append(doc_with_score)
+            scores = await asyncio.to_thread(
+                self.model.predict,
+                sentences_to_rerank,
+                batch_size=settings.RERANKER_BATCH_SIZE,
+                convert_to_numpy=True,
+                show_progress_bar=False,
+                # Scores in [0, 1], the scale RAG_SCORE_FLOOR / RAG_LOCALIZED_SCORE are set on.
+                **{_ACTIVATION_KWARG: torch.nn.Sigmoid()},
+            )
 
-            sorted_documents = sorted(scored_documents, key=lambda x: x['relevance_score'], reverse=True)
+            scores = np.asarray(scores, dtype=np.float32)
+            k = min(top_n, len(scores))
+            if k <= 0:
+                return []
+            # Select the top k in O(N), then order just those k.
+            top_indices = np.argpartition(-scores, k - 1)[:k]
+            top_indices = top_indices[np.argsort(-scores[top_indices])]
+            top_documents = [{**documents[i], 'relevance_score': float(scores[i])} for i in top_indices]
 
             logger.info(f"Re-ranked {len(documents)} documents. Returning top {top_n}.")
-            return sorted_documents[:top_n]
+            self.cache.set(cache_key, top_documents)
+            return list(top_documents)
 
         except Exception as e:
             logger.error(f"Error during re-ranking: {e}")
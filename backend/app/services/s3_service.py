@@ -1,9 +1,11 @@
 # app/services/s3_service.py 
 import aiobotocore.session
 import logging
+from contextlib import asynccontextmanager
+from botocore.config import Config
 from botocore.exceptions import ClientError
 from app.core.config import settings
-from typing import Optional
+from typing import BinaryIO, Optional
 from fastapi import UploadFile
 import os
 import asyncio
@@ -14,61 +16,138 @@ class S3Service:
         self.session = aiobotocore.session.get_session()
         self.bucket_name = settings.S3_BUCKET_NAME
         self.region_name = settings.AWS_REGION_NAME
+        self.s3_client = None
+        self._client_cm = None
 
-    async def upload_file(self, file: UploadFile, object_name: str) -> Optional[str]:
-        async with self.session.create_client(
+    def _create_client(self):
+        return self.session.create_client(
             's3',
             region_name=self.region_name,
             aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-            aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY 
-        ) as client:
+            aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
+            # botocore's standard mode retries throttling and transient errors with jittered backoff.
+            config=Config(retries={"max_attempts": settings.S3_MAX_ATTEMPTS, "mode": "standard"})
+        )
+
+    async def startup(self):
+        """Open the shared client. Must be called on the event loop that will use it."""
+        if self.s3_client is None:
+            self._client_cm = self._create_client()
+            self.s3_client = await self._client_cm.__aenter__()
+            logger.info("Shared S3 client initialized.")
+
+    async def shutdown(self):
+        if self._client_cm is not None:
+            await self._client_cm.__aexit__(None, None, None)
+            self._client_cm = None
+            self.s3_client = None
+            logger.info("Shared S3 client closed.")
+
+    @asynccontextmanager
+    async def _client(self):
+        # Processes that never called startup() (e.g. Celery workers) get a
+        # short-lived client per call.
+        if self.s3_client is not None:
+            yield self.s3_client
+        else:
+            async with self._create_client() as client:
+                yield client
+
+    async def upload_file(self, file: UploadFile, object_name: str) -> Optional[str]:
+        async with self._client() as client:
+            upload_id = None
             try:
-                file_content = await file.read()
-                await client.put_object(
-                    Bucket=self.bucket_name,
-                    Key=object_name,
-                    Body=file_content,
-                    ContentType=file.content_type
-                )
+                part_size = settings.S3_MULTIPART_CHUNK_SIZE
+                chunk = await file.read(part_size)
+                if len(chunk) < part_size:
+                    # Small file: a single PUT is cheaper than a multipart upload.
+                    await client.put_object(
+                        Bucket=self.bucket_name,
+                        Key=object_name,
+                        Body=chunk,
+                        ContentType=file.content_type
+                    )
+                else:
+                    response = await client.create_multipart_upload(
+                        Bucket=self.bucket_name,
+                        Key=object_name,
+                        ContentType=file.content_type
+                    )
+                    upload_id = response['UploadId']
+                    parts = []
+                    part_number = 1
+                    while chunk:
+                        # Read the next part from disk while the current one is on the wire.
+                        upload_part = asyncio.create_task(client.upload_part(
+                            Bucket=self.bucket_name,
+                            Key=object_name,
+                            PartNumber=part_number,
+                            UploadId=upload_id,
+                            Body=chunk
+                        ))
+                        next_chunk = await file.read(part_size)
+                        part_response = await upload_part
+                        parts.append({'ETag': part_response['ETag'], 'PartNumber': part_number})
+                        part_number += 1
+                        chunk = next_chunk
+                    await client.complete_multipart_upload(
+                        Bucket=self.bucket_name,
+                        Key=object_name,
+                        UploadId=upload_id,
+                        MultipartUpload={'Parts': parts}
+                    )
                 s3_url = f"https://{self.bucket_name}.s3.{self.region_name}.amazonaws.com/{object_name}"
                 logger.info(f"Successfully uploaded {object_name} to S3. URL: {s3_url}")
                 return s3_url
             except ClientError as e:
                 logger.error(f"Failed to upload file {object_name} to S3: {e}")
+                await self._abort_multipart_upload(client, object_name, upload_id)
                 return None
             except Exception as e:
                 logger.error(f"An unexpected error occurred during S3 upload of {object_name}: {e}")
+                await self._abort_multipart_upload(client, object_name, upload_id)
                 return None
 
-    async def download_file(self, object_name: str) -> Optional[bytes]:
-        async with self.session.create_client(
-            's3',
-            region_name=self.region_name,
-            aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-            aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY 
-        ) as client:
+    async def upload_bytes(self, data: bytes, object_name: str, content_type: str = "application/pdf") -> bool:
+        async with self._client() as client:
+            try:
+                await client.put_object(Bucket=self.bucket_name, Key=object_name, Body=data, ContentType=content_type)
+                logger.info(f"Successfully uploaded {object_name} to S3.")
+                return True
+            except Exception as e:
+                logger.error(f"Failed to upload {object_name} to S3: {e}")
+                return False
+
+    async def _abort_multipart_upload(self, client, object_name: str, upload_id: Optional[str]) -> None:
+        if upload_id is None:
+            return
+        try:
+            await client.abort_multipart_upload(Bucket=self.bucket_name, Key=object_name, UploadId=upload_id)
+        except Exception as e:
+            logger.error(f"Failed to abort multipart upload {upload_id} for {object_name}: {e}")
+
+    async def download_file(self, object_name: str, fileobj: BinaryIO, chunk_size: int = 1024 * 1024) -> bool:
+        """Stream an object into ``fileobj`` without holding the whole body in memory."""
+        async with self._client() as client:
             try:
                 response = await client.get_object(Bucket=self.bucket_name, Key=object_name)
-                file_content = await response['Body'].read()
+                async with response['Body'] as body:
+                    async for chunk in body.iter_chunks(chunk_size):
+                        fileobj.write(chunk)
                 logger.info(f"Successfully downloaded {object_name} from S3.")
-                return file_content
+                return True
             except ClientError as e:
                 if e.response['Error']['Code'] == 'NoSuchKey':
                     logger.warning(f"File {object_name} not found in S3.")
                 else:
                     logger.error(f"Failed to download file {object_name} from S3: {e}")
-                return None
+                return False
             except Exception as e:
                 logger.error(f"An unexpected error occurred during S3 download of {object_name}: {e}")
-                return None
+                return False
 
     async def delete_file(self, object_name: str) -> bool:
-        async with self.session.create_client(
-            's3',
-            region_name=self.region_name,
-            aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-            aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY 
-        ) as client:
+        async with self._client() as client:
             try:
                 await client.delete_object(Bucket=self.bucket_name, Key=object_name)
                 logger.info(f"Successfully deleted {object_name} from S3.")
@@ -82,7 +161,8 @@ class S3Service:
 
     async def object_exists(self, object_name: str) -> bool:
         try:
-            await asyncio.to_thread(self.s3_client.head_object, Bucket=self.bucket_name, Key=object_name)
+            async with self._client() as client:
+                await client.head_object(Bucket=self.bucket_name, Key=object_name)
             logger.debug(f"S3 object '{object_name}' found.")
             return True
         except ClientError as e:
@@ -1,13 +1,38 @@
 # app/services/vector_db_service.py
 import chromadb
+import httpx
 import logging
+import requests
 from chromadb.utils import embedding_functions
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Union
+import numpy as np
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_exponential_jitter
+
+from app.core.config import settings
 
 logger = logging.getLogger(__name__)
 
 CHROMA_DATA_PATH = "chroma_data"
 
+def _l2_normalize(embeddings) -> np.ndarray:
+    """Row-normalize in one vectorized pass so inner-product collections rank by cosine."""
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=-1, keepdims=True)
+    # A new array, so vectors owned by callers (e.g. the embedding cache) are never modified.
+    return np.ascontiguousarray(embeddings / np.clip(norms, 1e-12, None))
+
+def _is_transient_chroma_error(exc: BaseException) -> bool:
+    """
+    Network-level failures only; bad input (dimension mismatch, invalid metadata) fails fast.
+    Newer Chroma clients raise httpx errors, older ones requests errors.
+    """
+    if isinstance(exc, (httpx.HTTPStatusError, requests.exceptions.HTTPError)) and exc.response is not None:
+        return exc.response.status_code == 429 or exc.response.status_code >= 500
+    return isinstance(exc, (
+        ConnectionError, TimeoutError, httpx.TransportError,
+        requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+    ))
+
 class VectorDBService:
     def __init__(self):
         try:
@@ -23,7 +48,12 @@ class VectorDBService:
             logger.error("ChromaDB client not initialized. Cannot get or create collection.")
             return None
         try:
-            collection = self.client.get_or_create_collection(name=collection_name)
+            # Embeddings are L2-normalized at encode time, so inner product ranks like cosine
+            # without Chroma normalizing on every query.
+            collection = self.client.get_or_create_collection(
+                name=collection_name,
+                metadata={"hnsw:space": "ip"}
+            )
             logger.info(f"Accessed/Created ChromaDB collection: {collection_name}.")
             return collection
         except Exception as e:
@@ -34,40 +64,70 @@ class VectorDBService:
             self,
             collection,
             texts: List[str],
-            embeddings: List[List[float]],
+            embeddings: Union[np.ndarray, List[List[float]]],
             metadatas: Optional[List[Dict[str, Any]]] = None,
             ids: Optional[List[str]] = None
-    ):
+    ) -> bool:
         if collection is None:
             logger.error("Invalid ChromaDB collection. Cannot add chunks.")
-            return
+            return False
         
         if ids is None:
             ids = [f"chunk_{i}" for i in range(len(texts))]
         
         elif len(ids) != len(texts):
             logger.error("Number of IDs does not match number of texts.")
-            return
+            return False
         
         if len(texts) != len(embeddings):
             logger.error("Number of texts must match number of embeddings.")
-            return
+            return False
         
+        # Chroma's HNSW index holds float32 vectors whatever dtype is sent, so int8/float16
+        # inputs would only add quantization error without shrinking the index.
+        embeddings = _l2_normalize(embeddings)
+        batch_size = settings.CHROMA_ADD_BATCH_SIZE
         try:
-            collection.add(
-                documents=texts,
-                embeddings=embeddings,
-                metadatas=metadatas,
-                ids=ids
-            )
+            # Bounded request bodies instead of one HTTP call carrying the whole document.
+            for start in range(0, len(texts), batch_size):
+                end = start + batch_size
+                self._upsert_batch(
+                    collection,
+                    documents=texts[start:end],
+                    embeddings=embeddings[start:end],
+                    metadatas=metadatas[start:end] if metadatas is not None else None,
+                    ids=ids[start:end]
+                )
             logger.info(f"Added {len(texts)} chunks to collection {collection.name}.")
+            return True
         except Exception as e:
             logger.error(f"Failed to add chunks to collection: {collection.name} : {e}")
+            return False
+
+    @retry(
+        retry=retry_if_exception(_is_transient_chroma_error),
+        wait=wait_exponential_jitter(initial=1, max=30),
+        stop=stop_after_attempt(settings.CHROMA_RETRY_ATTEMPTS),
+        reraise=True,
+    )
+    def _upsert_batch(self, collection, **batch):
+        # upsert rather than add, so a retried batch that partly landed is not rejected.
+        collection.upsert(**batch)
+
+    def has_chunks(self, collection, ids: List[str]) -> bool:
+        """True if every id is already stored, i.e. a retried ingest can skip re-embedding."""
+        if collection is None or not ids:
+            return False
+        try:
+            return len(collection.get(ids=ids, include=[])['ids']) == len(ids)
+        except Exception as e:
+            logger.error(f"Failed to look up chunks in collection: {collection.name} : {e}")
+            return False
 
     def query_collection(
         self,
         collection,
-        query_embeddings: List[List[float]],
+        query_embeddings: Union[np.ndarray, List[List[float]]],
         n_results: int = 5,
         where_clause: Optional[Dict[str, Any]] = None
     ) -> List[Dict[str, Any]]:
@@ -76,22 +136,20 @@ class VectorDBService:
             return []
         try:
             results = collection.query(
-                query_embeddings=query_embeddings,
+                query_embeddings=_l2_normalize(query_embeddings),
                 n_results=n_results,
                 where=where_clause,
                 include=['documents', 'distances', 'metadatas']
             )
             logger.info(f"Queried collection {collection.name}, found {len(results['documents'][0])} results.")
-            formatted_results = []
-            if results and results['documents'] and results['documents'][0]:
-                for i in range(len(results['documents'][0])):
-                    formatted_results.append({
-                        "id": results['ids'][0][i],
-                        "document": results['documents'][0][i],
-                        "distance": results['distances'][0][i],
-                        "metadata": results['metadatas'][0][i]
-                    })
-            return formatted_results
+            if not (results and results['documents'] and results['documents'][0]):
+                return []
+            return [
+                {"id": chunk_id, "document": document, "distance": distance, "metadata": metadata}
+                for chunk_id, document, distance, metadata in zip(
+                    results['ids'][0], results['documents'][0], results['distances'][0], results['metadatas'][0]
+                )
+            ]
         except Exception as e:
             logger.error(f"Failed to query collection: {collection.name} : {e}")
             return []
@@ -3,156 +3,368 @@ from app.tasks.celery_app import celery_app
 from app.services.s3_service import s3_service
 from app.services.embedding_service import embedding_service
 from app.services.vector_db_service import vector_db_service
-from app.services.llm_service import llm_service 
+from app.services.llm_service import llm_service
 from app.db.session import get_db_sync
 from app.db.models import Document, DocumentStatus
+from app.core.config import settings
 import os
 import tempfile
+import time
 import fitz
-from langchain_text_splitters import RecursiveCharacterTextSplitter 
-from urllib.parse import urlparse, unquote
+from celery import chord
+from celery.utils import uuid
+from celery.signals import worker_process_init, worker_process_shutdown
+from typing import List, Tuple
 import asyncio
+import logging
 
-@celery_app.task(name="process_pdf_task", bind=True) 
-def process_pdf_task(self, document_id: int):
-    print(f"Starting PDF processing task for document_id: {document_id}")
+logger = logging.getLogger(__name__)
+
+# One event loop per worker process. asyncio.run() per call would tear down the
+# loop, and with it the pooled LLM and S3 connections bound to it, every stage.
+_worker_loop = None
+
+
+def _run_async(coro):
+    global _worker_loop
+    if _worker_loop is None or _worker_loop.is_closed():
+        _worker_loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(_worker_loop)
+    return _worker_loop.run_until_complete(coro)
+
+
+@worker_process_init.connect
+def _init_worker_process(**kwargs):
+    _run_async(s3_service.startup())
+
+
+@worker_process_shutdown.connect
+def _shutdown_worker_process(**kwargs):
+    if _worker_loop is None or _worker_loop.is_closed():
+        return
+    _run_async(s3_service.shutdown())
+    _run_async(llm_service.aclose())
+    _worker_loop.close()
+
+
+def _progress_reporter(task, document_id: int):
+    last_published = {'stage': None, 'at': 0.0}
 
     def update_processing_progress(stage, current_progress):
-        self.update_state(state='PROGRESS',
-                          meta={'stage': stage, 'current_progress': current_progress})
-        print(f"Document {document_id} progress: {stage} - {current_progress}%")
+        # Throttle only repeated updates of the same stage; a new stage and the
+        # final update always go out, so short stages are never lost.
+        now = time.monotonic()
+        if (current_progress >= 100 or stage != last_published['stage']
+                or now - last_published['at'] >= settings.TASK_PROGRESS_MIN_INTERVAL_SECONDS):
+            task.update_state(state='PROGRESS',
+                              meta={'stage': stage, 'current_progress': current_progress})
+            last_published['stage'] = stage
+            last_published['at'] = now
+        logger.debug(f"Document {document_id} progress: {stage} - {current_progress}%")
+    return update_processing_progress
 
 
-    with get_db_sync() as db:
-        document = db.query(Document).filter(Document.id == document_id).first()
-        if not document:
-            print(f"Document with ID {document_id} not found.")
-            return
+def _set_document_status(db, document: Document, processing_status: DocumentStatus):
+    document.processing_status = processing_status
+    db.add(document)
+    db.commit()
+    db.refresh(document)
+
 
-        print(f"Processing document: {document.title} from S3 path: {document.file_path}")
+def _download_pdf(object_name: str) -> str:
+    """Stream a PDF from S3 into a temporary file and return its path."""
+    logger.debug(f"Attempting to download S3 object: {object_name}...")
 
-        document.processing_status = DocumentStatus.PROCESSING
+    with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as temp_file:
+        downloaded = _run_async(s3_service.download_file(object_name, temp_file))
+    if not downloaded:
+        os.remove(temp_file.name)
+        raise RuntimeError(f"Failed to retrieve content for {object_name} from S3.")
+
+    logger.debug(f"Downloaded PDF content and saved to temporary path: {temp_file.name}")
+    return temp_file.name
+
+
+def _upload_page_ranges(doc, s3_object_key: str, page_ranges: List[Tuple[int, int]]) -> List[str]:
+    """Upload each page range as its own PDF, so every subtask downloads only its pages."""
+    part_keys = [f"{s3_object_key}.pages/{start}-{end}.pdf" for start, end in page_ranges]
+    part_bodies = []
+    for start, end in page_ranges:
+        part = fitz.open()
+        try:
+            part.insert_pdf(doc, from_page=start, to_page=end - 1)
+            part_bodies.append(part.tobytes())
+        finally:
+            part.close()
+
+    uploaded = _run_async(asyncio.gather(*(
+        s3_service.upload_bytes(body, part_key) for body, part_key in zip(part_bodies, part_keys)
+    )))
+    if not all(uploaded):
+        _run_async(asyncio.gather(*(s3_service.delete_file(part_key) for part_key in part_keys)))
+        raise RuntimeError(f"Failed to upload page ranges of {s3_object_key} to S3.")
+    return part_keys
+
+
+def _extract_text(doc, start_page: int = 0, end_page: int = None) -> str:
+    if end_page is None:
+        end_page = doc.page_count
+    try:
+        full_text = "\n".join(doc.load_page(page_number).get_text() for page_number in range(start_page, end_page))
+        logger.debug(f"Extracted {len(full_text)} characters from pages {start_page}-{end_page - 1}.")
+    except Exception as e:
+        raise RuntimeError(f"Failed to extract text from PDF: {e}")
+    return full_text
+
+
+def _split_for_rag(text: str) -> List[str]:
+    # Chunk Text (for RAG embeddings - this is separate from summarization chunking)
+    # Token windows are already full-size (only the tail is shorter), so there is nothing to merge.
+    chunks = embedding_service.split_into_token_windows(
+        text, settings.RAG_CHUNK_TOKENS, settings.RAG_CHUNK_OVERLAP_TOKENS
+    )
+    if chunks is None:
+        raise RuntimeError("Embedding model not loaded. Cannot chunk text for RAG.")
+    return chunks
+
+
+def _embed_and_store(document_id: int, chunks: List[str], chunk_id_prefix: str):
+    collection_name = f"doc_{document_id}"
+    logger.debug(f"Attempting to create ChromaDB collection: {collection_name}")
+    collection = vector_db_service.get_or_create_collection(collection_name)
+    if collection is None:
+        raise RuntimeError(f"Failed to get or create ChromaDB collection: {collection_name}.")
+    logger.debug(f"ChromaDB collection '{collection_name}' created/obtained successfully.")
+
+    chunk_ids = list(map(chunk_id_prefix.__add__, map(str, range(len(chunks)))))
+    if vector_db_service.has_chunks(collection, chunk_ids):
+        # A retry of a run that already indexed these chunks.
+        logger.info(f"Chunks '{chunk_id_prefix}*' already stored in '{collection_name}'. Skipping embedding.")
+        return
+
+    logger.debug(f"Generating embeddings for {len(chunks)} chunks...")
+    chunk_embeddings = embedding_service.get_embeddings(chunks, batch_size=settings.EMBEDDING_INGEST_BATCH_SIZE)
+    if chunk_embeddings is None:
+        raise RuntimeError("Failed to generate embeddings for chunks.")
+    logger.debug(f"Generated {len(chunk_embeddings)} embeddings.")
+
+    # Chroma serializes metadatas per request, so one shared (never mutated) dict is enough.
+    metadatas = [{"document_id": document_id}] * len(chunks)
+    logger.debug("Generated metadatas and chunk_ids. Adding chunks to ChromaDB...")
+    stored = vector_db_service.add_chunks_to_collection(
+        collection=collection,
+        texts=chunks,
+        embeddings=chunk_embeddings,
+        metadatas=metadatas,
+        ids=chunk_ids
+    )
+    if not stored:
+        raise RuntimeError(f"Failed to add chunks to ChromaDB collection: {collection_name}.")
+    logger.info(f"Successfully added chunks to ChromaDB collection: '{collection_name}'.")
+
+
+def _save_summary(db, document: Document, summary):
+    if summary:
+        document.summary = summary
         db.add(document)
         db.commit()
         db.refresh(document)
-        update_processing_progress("Initializing", 5) 
+        logger.info(f"Generated and saved summary for document {document.id}.")
+    else:
+        logger.error(f"Failed to generate summary for document {document.id}.")
 
 
-        temp_pdf_path = None
-        try:
-            # 1. Download PDF from S3
-            update_processing_progress("Downloading from S3", 10)
-            parsed_url = urlparse(document.file_path)
-            object_name = unquote(parsed_url.path.lstrip('/'))
+def _generate_and_save_summary(db, document: Document, full_text: str):
+    summary = _run_async(llm_service.generate_summary(
+        full_text, max_input_tokens=30000, max_attempts=settings.LLM_RETRY_ATTEMPTS
+    ))
+    _save_summary(db, document, summary)
+
+
+async def _summarize_and_index(document_id: int, full_text: str, chunks: List[str]):
+    """Run the LLM summary and the embedding/Chroma insert side by side; returns the summary."""
+    summary_task = asyncio.ensure_future(llm_service.generate_summary(
+        full_text, max_input_tokens=30000, max_attempts=settings.LLM_RETRY_ATTEMPTS
+    ))
+    try:
+        await asyncio.to_thread(_embed_and_store, document_id, chunks, f"doc_{document_id}_chunk_")
+    except BaseException:
+        # Don't leave the summary running on the worker loop for a failed document.
+        summary_task.cancel()
+        raise
+    return await summary_task
+
 
-            if not object_name:
-                raise ValueError(f"Could not extract S3 object name from URL: {document.file_path}")
+@celery_app.task(name="process_pdf_task", bind=True)
+def process_pdf_task(self, document_id: int):
+    """
+    Process an uploaded PDF. Documents longer than PDF_PAGES_PER_SUBTASK pages
+    are fanned out as a chord of page-range subtasks finished by finalize_pdf_task.
+    """
+    logger.info(f"Starting PDF processing task for document_id: {document_id}")
+    update_processing_progress = _progress_reporter(self, document_id)
+
+    with get_db_sync() as db:
+        document = db.query(Document).filter(Document.id == document_id).first()
+        if not document:
+            logger.warning(f"Document with ID {document_id} not found.")
+            return
 
-            print(f"Attempting to download S3 object: {object_name}...")
+        logger.info(f"Processing document: {document.title} from S3 key: {document.s3_object_key}")
 
-            pdf_content_bytes = asyncio.run(s3_service.download_file(object_name))
+        _set_document_status(db, document, DocumentStatus.PROCESSING)
+        update_processing_progress("Initializing", 5)
 
-            if pdf_content_bytes is None:
-                raise RuntimeError(f"Failed to retrieve content for {object_name} from S3.")
 
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as temp_file:
-                temp_pdf_path = temp_file.name
-                temp_file.write(pdf_content_bytes) 
-            print(f"Downloaded PDF content and saved to temporary path: {temp_pdf_path}")
+        temp_pdf_path = None
+        try:
+            # 1. Download PDF from S3
+            update_processing_progress("Downloading from S3", 10)
+            temp_pdf_path = _download_pdf(document.s3_object_key)
             update_processing_progress("Download complete", 20)
 
-            # 2. Extract Text from PDF
+            # 2. Extract Text from PDF, or fan out large documents by page range
             update_processing_progress("Extracting text", 30)
-            full_text = ""
+            doc = fitz.open(temp_pdf_path)
             try:
-                doc = fitz.open(temp_pdf_path)
-                for page in doc:
-                    full_text += page.get_text()
-                doc.close()
-                print(f"Extracted {len(full_text)} characters from PDF.")
-                if not full_text.strip():
-                    raise ValueError("Extracted text is empty or only whitespace.")
-            except Exception as e:
-                raise RuntimeError(f"Failed to extract text from PDF: {e}")
-            update_processing_progress("Text extraction complete", 40)
+                page_count = doc.page_count
+                if page_count > settings.PDF_PAGES_PER_SUBTASK:
+                    page_ranges = [
+                        (start, min(start + settings.PDF_PAGES_PER_SUBTASK, page_count))
+                        for start in range(0, page_count, settings.PDF_PAGES_PER_SUBTASK)
+                    ]
+                    # Split the one downloaded copy by page range; subtasks parse their
+                    # ranges in parallel without re-downloading the whole PDF.
+                    part_keys = _upload_page_ranges(doc, document.s3_object_key, page_ranges)
 
-            update_processing_progress("Generating summary", 45)
+                    # Status polling follows the chord callback from here on; the subtasks
+                    # publish their progress under its id until it starts.
+                    finalize_task_id = uuid()
+                    document.celery_task_id = finalize_task_id
+                    db.add(document)
+                    db.commit()
+                    self.update_state(task_id=finalize_task_id, state='PROGRESS',
+                                      meta={'stage': f"Indexing 0/{len(page_ranges)} page ranges", 'current_progress': 30})
 
-            summary = asyncio.run(llm_service.generate_summary(full_text, max_input_tokens=30000)) 
-            if summary:
-                document.summary = summary
-                db.add(document)
-                db.commit()
-                db.refresh(document)
-                print(f"Generated and saved summary for document {document.id}.")
-            else:
-                print(f"Failed to generate summary for document {document.id}.")
-            update_processing_progress("Summary generation complete", 48)
+                    callback = (finalize_pdf_task.s(document_id)
+                                .set(task_id=finalize_task_id)
+                                .on_error(mark_pdf_failed_task.si(document_id)))
+                    chord(
+                        process_pdf_pages_task.s(document_id, start, end, part_key, finalize_task_id, len(page_ranges))
+                        for (start, end), part_key in zip(page_ranges, part_keys)
+                    )(callback)
+                    logger.info(f"Document {document_id} has {page_count} pages. Dispatched {len(page_ranges)} subtasks.")
+                    return
 
+                full_text = _extract_text(doc)
+            finally:
+                doc.close()
+            if not full_text.strip():
+                raise ValueError("Extracted text is empty or only whitespace.")
+            update_processing_progress("Text extraction complete", 40)
 
             # 3. Chunk Text (for RAG embeddings - this is separate from summarization chunking)
-            update_processing_progress("Chunking text for RAG", 50)
-            text_splitter = RecursiveCharacterTextSplitter(
-                chunk_size=1000,
-                chunk_overlap=200,
-                length_function=len, 
-                is_separator_regex=False,
-            )
-            chunks = text_splitter.split_text(full_text)
-            print(f"Split document into {len(chunks)} chunks for RAG.")
+            update_processing_progress("Chunking text for RAG", 45)
+            chunks = _split_for_rag(full_text)
+            logger.info(f"Split document into {len(chunks)} chunks for RAG.")
             if not chunks:
                 raise ValueError("No chunks generated from the document text for RAG.")
-            update_processing_progress("Text chunking for RAG complete", 60)
-
-            # 4. Generating embeddings for chunks
-            update_processing_progress("Generating embeddings", 70)
-            print(f"Generating embeddings for {len(chunks)} chunks...")
-            chunk_embeddings = embedding_service.get_embeddings(chunks)
-            if not chunk_embeddings:
-                raise RuntimeError("Failed to generate embeddings for chunks.")
-            print(f"Generated {len(chunk_embeddings)} embeddings.")
-            update_processing_progress("Embeddings generated", 80)
-
-            # 5. Store Chunks and Embeddings in ChromaDB
-            update_processing_progress("Storing in vector DB", 90)
-            collection_name = f"doc_{document.id}"
-            print(f"Attempting to create ChromaDB collection: {collection_name}")
-            collection = vector_db_service.get_or_create_collection(collection_name)
-            if collection is None:
-                raise RuntimeError(f"Failed to get or create ChromaDB collection: {collection_name}.")
-            print(f"ChromaDB collection '{collection_name}' created/obtained successfully.")
-
-            metadatas = [{"document_id": document.id} for _ in chunks]
-            chunk_ids = [f"doc_{document_id}_chunk_{i}" for i in range(len(chunks))]
-            print("Generated metadatas and chunk_ids. Adding chunks to ChromaDB...")
-            vector_db_service.add_chunks_to_collection(
-                collection=collection,
-                texts=chunks,
-                embeddings=chunk_embeddings,
-                metadatas=metadatas,
-                ids=chunk_ids
-            )
-            print(f"Successfully added chunks to ChromaDB collection: '{collection_name}'.")
-            update_processing_progress("Vector DB storage complete", 95)
-
-            # 6. Update document status
-            document.processing_status = DocumentStatus.COMPLETED
-            db.add(document)
-            db.commit()
-            db.refresh(document)
-            print(f"Document {document.id} status updated to COMPLETED after processing.")
-            update_processing_progress("Processing completed", 100) 
+            update_processing_progress("Text chunking for RAG complete", 50)
+
+            # 4. Summarize with the LLM while embeddings are generated and stored in ChromaDB
+            update_processing_progress("Generating summary and embeddings", 60)
+            summary = _run_async(_summarize_and_index(document.id, full_text, chunks))
+            _save_summary(db, document, summary)
+            update_processing_progress("Summary and vector DB storage complete", 95)
+
+            # 5. Update document status
+            _set_document_status(db, document, DocumentStatus.COMPLETED)
+            logger.info(f"Document {document.id} status updated to COMPLETED after processing.")
+            update_processing_progress("Processing completed", 100)
 
         except Exception as e:
-            print(f"Error processing document {document_id}: {e}")
-            document.processing_status = DocumentStatus.FAILED
-            db.add(document)
-            db.commit()
-            db.refresh(document)
+            logger.error(f"Error processing document {document_id}: {e}")
+            _set_document_status(db, document, DocumentStatus.FAILED)
             self.update_state(state='FAILED', meta={'exc': str(e), 'current_progress': 0})
         finally:
             if temp_pdf_path and os.path.exists(temp_pdf_path):
                 os.remove(temp_pdf_path)
-                print(f"Cleaned up temporary PDF file: {temp_pdf_path}")
+                logger.debug(f"Cleaned up temporary PDF file: {temp_pdf_path}")
+
+    logger.info(f"Finished PDF processing task for document_id: {document_id}")
+
 
-    print(f"Finished PDF processing task for document_id: {document_id}")
\ No newline at end of file
+@celery_app.task(name="process_pdf_pages_task", bind=True)
+def process_pdf_pages_task(self, document_id: int, start_page: int, end_page: int, part_key: str,
+                           progress_task_id: str, range_count: int) -> str:
+    """
+    Extract, chunk, embed and store one page range of a large PDF, uploaded on its own
+    under ``part_key``. Returns the extracted text for finalize_pdf_task.
+    """
+    logger.info(f"Processing pages {start_page}-{end_page - 1} of document {document_id}")
+    temp_pdf_path = None
+    try:
+        temp_pdf_path = _download_pdf(part_key)
+        doc = fitz.open(temp_pdf_path)
+        try:
+            text = _extract_text(doc)
+        finally:
+            doc.close()
+
+        chunks = _split_for_rag(text)
+        if chunks:
+            _embed_and_store(document_id, chunks, f"doc_{document_id}_p{start_page}_chunk_")
+        logger.info(f"Stored {len(chunks)} chunks for pages {start_page}-{end_page - 1} of document {document_id}.")
+    finally:
+        if temp_pdf_path and os.path.exists(temp_pdf_path):
+            os.remove(temp_pdf_path)
+        _run_async(s3_service.delete_file(part_key))
+
+    # Count finished ranges in the (Redis) result backend, so progress stays
+    # monotonic however the subtasks are scheduled across workers.
+    counter_key = f"pdf-ranges-done-{progress_task_id}"
+    done = self.backend.incr(counter_key)
+    self.backend.expire(counter_key, celery_app.conf.result_expires)
+    self.update_state(task_id=progress_task_id, state='PROGRESS',
+                      meta={'stage': f"Indexing {done}/{range_count} page ranges",
+                            'current_progress': 30 + (30 * done) // range_count})
+    return text
+
+
+@celery_app.task(name="finalize_pdf_task", bind=True)
+def finalize_pdf_task(self, page_texts: List[str], document_id: int):
+    """Chord callback: summarize the full text of a fanned-out PDF and mark it COMPLETED."""
+    update_processing_progress = _progress_reporter(self, document_id)
+
+    with get_db_sync() as db:
+        document = db.query(Document).filter(Document.id == document_id).first()
+        if not document:
+            logger.warning(f"Document with ID {document_id} not found.")
+            return
+
+        try:
+            full_text = "\n".join(page_texts)
+            if not full_text.strip():
+                raise ValueError("Extracted text is empty or only whitespace.")
+
+            update_processing_progress("Generating summary", 60)
+            _generate_and_save_summary(db, document, full_text)
+            update_processing_progress("Summary generation complete", 95)
+
+            _set_document_status(db, document, DocumentStatus.COMPLETED)
+            logger.info(f"Document {document.id} status updated to COMPLETED after processing.")
+            update_processing_progress("Processing completed", 100)
+        except Exception as e:
+            logger.error(f"Error finalizing document {document_id}: {e}")
+            _set_document_status(db, document, DocumentStatus.FAILED)
+            self.update_state(state='FAILED', meta={'exc': str(e), 'current_progress': 0})
+
+
+@celery_app.task(name="mark_pdf_failed_task")
+def mark_pdf_failed_task(document_id: int):
+    """Chord error callback: a page-range subtask failed."""
+    with get_db_sync() as db:
+        document = db.query(Document).filter(Document.id == document_id).first()
+        if document:
+            _set_document_status(db, document, DocumentStatus.FAILED)
+            logger.info(f"Document {document_id} marked FAILED after a page-range subtask failed.")
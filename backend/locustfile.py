@@ -1,22 +1,58 @@
 import time
-from locust import HttpUser, task, between
+from locust import task, between
+from locust.contrib.fasthttp import FastHttpUser
+import logging
 import random
 import os
-import io
+import orjson
+from collections import defaultdict
+from urllib.parse import urlencode
+from gevent import sleep as gsleep
+from gevent.lock import Semaphore
+from urllib3 import encode_multipart_formdata
 from locust import events
 
+logger = logging.getLogger(__name__)
+
 BASE_URL = "http://localhost:8001" 
+# Connections per simulated user; >1 needs locust-plugins and spreads requests across source ports.
+POOL_SIZE = int(os.getenv("LOCUST_POOL_SIZE", "1"))
+# Documents per /upload_batch request (the API accepts up to MAX_UPLOAD_BATCH_SIZE).
+UPLOAD_BATCH_SIZE = int(os.getenv("LOCUST_UPLOAD_BATCH_SIZE", "5"))
+# Weight of the batch-upload task. 0 (the default) keeps it out of the mix, since its
+# documents go through the full processing pipeline on top of the regular uploads.
+UPLOAD_BATCH_WEIGHT = int(os.getenv("LOCUST_UPLOAD_BATCH_WEIGHT", "0"))
+# Number of accounts the simulated users share; 0 gives every user its own account.
+SHARED_USERS = int(os.getenv("LOCUST_SHARED_USERS", "0"))
+
+# Worker-level token cache keyed by (email, password), so users sharing an account
+# register/log in once instead of each paying for bcrypt on the auth endpoints.
+_TOKEN_CACHE: dict[tuple[str, str], str] = {}
+_TOKEN_LOCKS = defaultdict(Semaphore)
 
-class DocumentUser(HttpUser):
+# Resolved and read once at import; every upload reuses the same bytes object.
+_PDF_PATH = os.path.join(os.path.dirname(__file__), "test.pdf")
+_PDF_MISSING = not os.path.exists(_PDF_PATH)
+_PDF_BYTES = None
+if _PDF_MISSING:
+    logger.warning(f"'test.pdf' not found at {_PDF_PATH}. Please create a small 'test.pdf' file for realistic testing.")
+else:
+    with open(_PDF_PATH, "rb") as f:
+        _PDF_BYTES = f.read()
+
+class DocumentUser(FastHttpUser):
     """
     A user class that simulates interactions with the document summarizer API.
     """
     host = BASE_URL
     wait_time = between(1, 5)
+    connection_timeout = 10.0
+    network_timeout = 120.0
 
     _user_email = None
     _password = "testpassword" 
     _access_token = None
+    _auth_headers = None
     _uploaded_document_id = None
     _document_title = None
 
@@ -24,18 +60,44 @@ class DocumentUser(HttpUser):
         """
         On start, each user attempts to register or log in.
         """
+        if POOL_SIZE > 1:
+            from locust_plugins.connection_pools import FastHttpPool
+            self.http = FastHttpPool(user=self, size=POOL_SIZE)
+        else:
+            self.http = self.client
+
         user_id = str(random.randint(100000, 999999))
-        self._user_email = f"testuser_{user_id}@example.com"
         self._document_title = f"Test_Document_{user_id}"
 
+        if SHARED_USERS <= 0:
+            self._user_email = f"testuser_{user_id}@example.com"
+            self.register()
+            return
+
+        self._user_email = f"testuser_shared_{random.randrange(SHARED_USERS)}@example.com"
+        key = (self._user_email, self._password)
+        # Users racing for the same account wait here instead of all hitting /auth.
+        with _TOKEN_LOCKS[key]:
+            self._access_token = _TOKEN_CACHE.get(key)
+            if self._access_token:
+                self._auth_headers = {'Authorization': f'Bearer {self._access_token}'}
+                return
+            self.register()
+            if self._access_token:
+                _TOKEN_CACHE[key] = self._access_token
+
+    def register(self):
+        """
+        Registers the user, falling back to login if it already exists.
+        """
         register_data = {"email": self._user_email, "password": self._password}
-        with self.client.post("/api/v1/auth/register", json=register_data, catch_response=True, name="/api/v1/auth/register") as response:
+        with self.http.post("/api/v1/auth/register", json=register_data, catch_response=True, name="/api/v1/auth/register") as response:
             if response.status_code == 201:
-                print(f"User {self._user_email} registered successfully.")
+                logger.debug(f"User {self._user_email} registered successfully.")
                 response.success()
                 self.login()
             elif response.status_code == 409: 
-                print(f"User {self._user_email} already exists, attempting login.")
+                logger.debug(f"User {self._user_email} already exists, attempting login.")
                 response.success()
                 self.login()
             else:
@@ -47,13 +109,15 @@ class DocumentUser(HttpUser):
         Logs in the user and stores the access token.
         """
         login_data = {"username": self._user_email, "password": self._password}
-        with self.client.post("/api/v1/auth/token", data=login_data, catch_response=True, name="/api/v1/auth/token") as response:
+        with self.http.post("/api/v1/auth/token", data=login_data, catch_response=True, name="/api/v1/auth/token") as response:
             if response.status_code == 200:
                 try:
-                    response_json = response.json()
+                    response_json = orjson.loads(response.content)
                     self._access_token = response_json.get("access_token")
                     if self._access_token:
-                        print(f"User {self._user_email} logged in. Token (first 50 chars): {self._access_token[:50]}...")
+                        # Built once and reused by every authenticated request.
+                        self._auth_headers = {'Authorization': f'Bearer {self._access_token}'}
+                        logger.debug(f"User {self._user_email} logged in.")
                         response.success()
                     else:
                         response.failure(f"Login successful (200 OK) but no 'access_token' in response for {self._user_email}. Full response: {response.text}")
@@ -63,7 +127,7 @@ class DocumentUser(HttpUser):
                     self._access_token = None
             else:
                 response.failure(f"Failed to login user {self._user_email}: {response.status_code} - {response.text}")
-                print(f"DEBUG: Login failed response for {self._user_email} (Status: {response.status_code}): {response.text}")
+                logger.debug(f"Login failed response for {self._user_email} (Status: {response.status_code}): {response.text}")
                 self._access_token = None
 
     @task(3) # Task weight
@@ -72,16 +136,11 @@ class DocumentUser(HttpUser):
         Simulates uploading a document and then querying it.
         """
         if not self._access_token:
-            print(f"Skipping upload for {self._user_email}: No access token.")
+            logger.debug(f"Skipping upload for {self._user_email}: No access token.")
             return
 
-        test_pdf_file_path = os.path.join(os.path.dirname(__file__), "test.pdf")
-        pdf_content = None
-        if os.path.exists(test_pdf_file_path):
-            with open(test_pdf_file_path, "rb") as f:
-                pdf_content = f.read()
-        else:
-            print(f"ERROR: 'test.pdf' not found at {test_pdf_file_path}. Please create a small 'test.pdf' file for realistic testing.")
+        if _PDF_MISSING:
+            logger.debug(f"Skipping upload: 'test.pdf' not found at {_PDF_PATH}.")
             events.request.fire(
                 request_type="POST",
                 name="Upload Document (Missing PDF)",
@@ -92,32 +151,63 @@ class DocumentUser(HttpUser):
             )
             return
 
-        files = {'file': (f'{self._document_title}.pdf', io.BytesIO(pdf_content), 'application/pdf')}
-        data = {'title': self._document_title}
-        headers = {'Authorization': f'Bearer {self._access_token}'}
+        # FastHttpUser has no files= support, so the multipart body is encoded here.
+        body, content_type = encode_multipart_formdata({
+            'title': self._document_title,
+            'file': (f'{self._document_title}.pdf', _PDF_BYTES, 'application/pdf'),
+        })
+        headers = {**self._auth_headers, 'Content-Type': content_type}
 
-        with self.client.post("/api/v1/documents/upload", files=files, data=data, headers=headers, catch_response=True, name="/api/v1/documents/upload") as response:
+        # wait_initial asks the API to hold the response until the worker picks the task up.
+        with self.http.post("/api/v1/documents/upload?wait_initial=1", data=body, headers=headers, catch_response=True, name="/api/v1/documents/upload") as response:
             if response.status_code == 201:
-                self._uploaded_document_id = response.json().get("id")
-                self._document_title = response.json().get("title")
+                upload_data = orjson.loads(response.content)
+                self._uploaded_document_id = upload_data.get("id")
+                self._document_title = upload_data.get("title")
+                if upload_data.get("celery_state") == "FAILURE":
+                    response.failure(f"Processing failed to start for document {self._uploaded_document_id}")
+                    return
                 response.success()
-                
+                if upload_data.get("processing_started_at"):
+                    logger.debug(f"Document {self._uploaded_document_id} processing already started at upload.")
+
                 self.wait_for_processing_and_query() 
             else:
                 response.failure(f"Failed to upload document for {self._user_email}: {response.status_code} - {response.text}")
                 self._uploaded_document_id = None
 
+    @task(UPLOAD_BATCH_WEIGHT)
+    def upload_document_batch(self):
+        """
+        Simulates uploading several documents in a single request.
+        """
+        if not self._access_token or _PDF_MISSING:
+            return
+
+        fields = []
+        for i in range(UPLOAD_BATCH_SIZE):
+            title = f"{self._document_title}_batch_{i}"
+            fields.append(('titles', title))
+            fields.append(('files', (f'{title}.pdf', _PDF_BYTES, 'application/pdf')))
+        body, content_type = encode_multipart_formdata(fields)
+        headers = {**self._auth_headers, 'Content-Type': content_type}
+
+        with self.http.post("/api/v1/documents/upload_batch", data=body, headers=headers, catch_response=True, name="/api/v1/documents/upload_batch") as response:
+            if response.status_code == 201:
+                response.success()
+            else:
+                response.failure(f"Failed to upload document batch for {self._user_email}: {response.status_code} - {response.text}")
+
     @task(1) 
     def get_documents_list(self):
         """
         Simulates fetching the list of documents.
         """
         if not self._access_token:
-            print(f"Skipping get_documents_list for {self._user_email}: No access token.")
+            logger.debug(f"Skipping get_documents_list for {self._user_email}: No access token.")
             return
 
-        headers = {'Authorization': f'Bearer {self._access_token}'}
-        with self.client.get("/api/v1/documents", headers=headers, catch_response=True, name="/api/v1/documents") as response:
+        with self.http.get("/api/v1/documents", headers=self._auth_headers, catch_response=True, name="/api/v1/documents") as response:
             if response.status_code == 200:
                 response.success()
             else:
@@ -131,31 +221,34 @@ class DocumentUser(HttpUser):
         if not self._uploaded_document_id or not self._access_token:
             return
 
-        max_attempts = 30
-        poll_interval = 2
+        # Each request long-polls server-side until the document is completed/failed
+        # or long_poll_seconds pass, so there is no client-side sleep between polls.
+        long_poll_seconds = 30
+        timeout_seconds = 60
+        error_retry_interval = 0.5
+        deadline = time.monotonic() + timeout_seconds
 
-        for i in range(max_attempts):
-            time.sleep(poll_interval)
-            headers = {'Authorization': f'Bearer {self._access_token}'}
-            with self.client.get(f"/api/v1/documents/{self._uploaded_document_id}/processing_status", headers=headers, catch_response=True, name="/api/v1/documents/:id/processing_status") as status_response:
+        while time.monotonic() < deadline:
+            with self.http.get(f"/api/v1/documents/{self._uploaded_document_id}/processing_status/?wait={long_poll_seconds}", headers=self._auth_headers, catch_response=True, name="/api/v1/documents/:id/processing_status") as status_response:
                 if status_response.status_code == 200:
-                    status_data = status_response.json()
+                    status_data = orjson.loads(status_response.content)
                     db_status = status_data.get("db_status")
+                    if db_status == "failed":
+                        status_response.failure(f"Document {self._uploaded_document_id} processing failed: {status_data.get('celery_state', 'N/A')}")
+                        return
+                    status_response.success()
                     if db_status == "completed":
-                        status_response.success()
                         self.query_document_task()
                         return
-                    elif db_status == "failed":
-                        status_response.failure(f"Document {self._uploaded_document_id} processing failed: {status_data.get('celery_state', 'N/A')}")
-                        return
                 else:
                     status_response.failure(f"Failed to get status for document {self._uploaded_document_id}: {status_response.status_code}")
-            
-        print(f"Document {self._uploaded_document_id} processing timed out after {max_attempts * poll_interval} seconds.")
+                    gsleep(error_retry_interval)
+
+        logger.debug(f"Document {self._uploaded_document_id} processing timed out after {timeout_seconds} seconds.")
         events.request.fire(
             request_type="GET",
             name="Get Document Status (Timed Out)",
-            response_time=(max_attempts * poll_interval * 1000),
+            response_time=(timeout_seconds * 1000),
             response_length=0, 
             response=None,
             exception=f"Processing timed out for document {self._uploaded_document_id}"
@@ -168,16 +261,15 @@ class DocumentUser(HttpUser):
         This is a helper method, not a Locust @task.
         """
         if not self._uploaded_document_id or not self._access_token:
-            print("Skipping query: No document ID or token.")
+            logger.debug("Skipping query: No document ID or token.")
             return
 
         query_text = "What is the main topic of the document?"
-        headers = {'Authorization': f'Bearer {self._access_token}'}
-        params = {"query_text": query_text}
+        query_string = urlencode({"query_text": query_text})
 
-        with self.client.get(f"/api/v1/documents/{self._uploaded_document_id}/query/", params=params, headers=headers, catch_response=True, name="/api/v1/documents/:id/query") as response:
+        with self.http.get(f"/api/v1/documents/{self._uploaded_document_id}/query/?{query_string}", headers=self._auth_headers, catch_response=True, name="/api/v1/documents/:id/query") as response:
             if response.status_code == 200:
-                llm_answer = response.json().get("llm_answer")
+                llm_answer = orjson.loads(response.content).get("llm_answer")
                 if llm_answer:
                     response.success()
                 else: